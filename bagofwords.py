@@ -7,6 +7,7 @@
 from tokenizer import *
 from nlp import *
 import math
+import os
 import argparse
 
 
@@ -81,18 +82,15 @@ def compute_idf(docs, vocab):
     return idf
 
 
-def apply_bpe(doc, merges):
+def apply_bpe(doc, encoder):
     """
     BPE uitvoeren op het gegeven document.
     :param doc: een document.
-    :param merges: de merges in van tokens in het document.
+    :param encoder: een WordEncoder met de merges van tokens, gedeeld tussen documenten.
     """
-    tokens = doc[:]
     flat_tokens = []
-    for merge in merges:
-        tokens = byte_pair_encoding(tokens, merge)
-    for word in tokens:
-        for piece in word:
+    for word in doc:
+        for piece in encoder.encode(word):
             flat_tokens.append(piece)
     return flat_tokens
 
@@ -112,55 +110,124 @@ def write_to_bow(vocabulary, vectors, path):
             f.write(f"{vector}\n")
 
 
+def bow_output_path(path):
+    """
+    Het .bow pad bij een invoerbestand: de extensie wordt vervangen door .bow.
+    """
+    return os.path.splitext(path)[0] + ".bow"
+
+
+def load_or_fit(args, fit, make_documents):
+    """
+    Laad het model uit --model, of leer het met fit() en sla het op als --save-model gegeven is.
+    Bij --encoding hashed is alleen een BPE encoding nodig: de merges uit --model (een
+    hashed of gewoon model), of geleerd op make_documents(), zonder vocabulary en IDF.
+    """
+    if args.encoding == "hashed":
+        if args.model:
+            return HashingVectorizer.load(args.model, args.n_features, args.ngram)
+        merges, _ = learn_merges(make_documents(), args.minfreq)
+        vectorizer = HashingVectorizer(merges, args.n_features, args.ngram)
+        if args.save_model:
+            vectorizer.save(args.save_model)
+            print(f"Model opgeslagen in {args.save_model}")
+        else:
+            print("Let op: zonder --model worden de merges opnieuw geleerd, gebruik --save-model "
+                  "en daarna --model om de kolommen tussen runs gelijk te houden.")
+        return vectorizer
+    if args.model:
+        return BagOfWordsVectorizer.load(args.model)
+    vectorizer = fit(BagOfWordsVectorizer(args.encoding, args.minfreq))
+    if args.save_model:
+        vectorizer.save(args.save_model)
+        print(f"Model opgeslagen in {args.save_model}")
+    return vectorizer
+
+
+def stream_bow(args):
+    """
+    Out-of-core bag of words: de documenten worden lazy gelezen, eerst voor de BPE
+    woord-counts en de document-frequenties, daarna nog een keer om de rijen in
+    batches naar elke .bow te schrijven. Alleen een batch staat in het geheugen.
+    """
+    make_documents = lambda: iter_documents(args.filepath)
+    vectorizer = load_or_fit(args, lambda v: v.fit_stream(make_documents, args.batch_size),
+                             make_documents)
+    idf = vectorizer.idf if args.encoding == "tfidf" else None
+    data_dtype = np.float64 if args.encoding == "tfidf" else np.int32
+
+    for path in args.filepath:
+        out_path = bow_output_path(path)
+        with BowWriter(out_path, vectorizer.vocabulary, args.encoding, idf, data_dtype,
+                       vectorizer.n_features) as writer:
+            vectorizer.transform_stream(iter_documents([path]), writer, args.batch_size,
+                                        args.encoding)
+        print(f"Bag of words met het bestand: {path}")
+        print(f"{writer.n_rows} documenten x {vectorizer.n_features} tokens, "
+              f"{writer.nnz} waarden ({args.encoding})")
+        print(f"BOW succesvol geschreven naar {out_path}")
+
+
 def main():
     parser = argparse.ArgumentParser(description="Bag of words encoder")
     parser.add_argument("filepath", nargs="+", help="Path(s) to corpus text file")
-    parser.add_argument("--encoding", type=str, choices=["multi-hot", "count", "tfidf"],
+    parser.add_argument("--encoding", type=str, choices=["multi-hot", "count", "tfidf", "hashed"],
                         default="count", help="Type of encoding")
+    parser.add_argument("--n-features", type=int, default=2**20,
+                        help="Number of hash buckets with --encoding hashed")
+    parser.add_argument("--ngram", type=int, default=1,
+                        help="Also hash token n-grams up to this order with --encoding hashed")
     parser.add_argument("--minfreq", type=int,
                         default=2, help="Minimum frequency of tokens in the text")
+    parser.add_argument("--text", action="store_true",
+                        help="Write the old text .bow instead of the binary format (see load_bow)")
+    parser.add_argument("--model", help="Use a saved vectorizer (merges, vocabulary, IDF) instead of fitting")
+    parser.add_argument("--save-model", help="Save the fitted vectorizer to this path")
+    parser.add_argument("--stream", action="store_true",
+                        help="Read the documents lazily and write the rows in batches (bounded memory)")
+    parser.add_argument("--batch-size", type=int, default=10000,
+                        help="Documents per batch with --stream")
     args = parser.parse_args()
 
+    for path in args.filepath:
+        if bow_output_path(path) == path:
+            parser.error(f"'{path}' is al een .bow, de uitvoer zou de invoer overschrijven")
+    if args.text and args.encoding == "hashed":
+        parser.error("--encoding hashed writes the binary .bow format, not --text")
+    if args.stream:
+        if args.text:
+            parser.error("--stream writes the binary .bow format, not --text")
+        stream_bow(args)
+        return
+
     all_documents = []
     for path in args.filepath:
         with open(path, "r", encoding="utf-8") as f:
-            all_documents.append([pre_process(line) for line in f])
-
-    flat_tokens = [token for doc_list in all_documents for doc in doc_list for token in doc]
-
-    merges = []
-    min_frequency = args.minfreq
-
-    for _ in range(9999):
-        token_set = tokenizer(flat_tokens)
-        new_token = sort_and_return_token(token_set, min_frequency)
-        if new_token is None:
-            break
-        merges.append(new_token)
-        flat_tokens = byte_pair_encoding(flat_tokens, new_token)
-    vocab_count, vocabulary = get_vocabulary(flat_tokens)
-    vocab_to_idx = {token: i for i, token in enumerate(vocabulary)}
-
-    bpe_per_file = []
-    for docs in all_documents:
-        bpe_per_file.append([apply_bpe(doc, merges) for doc in docs])
-
-    if args.encoding == "tfidf":
-        idf_scores = compute_idf([doc for file_docs in bpe_per_file for doc in file_docs], vocab_to_idx)
-    else:
-        idf_scores = None
-
-    for path, bpe_docs in zip(args.filepath, bpe_per_file):
-        vectors = []
-        for doc in bpe_docs:
-            if args.encoding == "multi-hot":
-                vectors.append(multi_hot(doc, vocab_to_idx))
-            elif args.encoding == "count":
-                vectors.append(count_encoding(doc, vocab_to_idx))
-            elif args.encoding == "tfidf":
-                vectors.append(tf_idf_vector(doc, vocab_to_idx, idf_scores))
-
-        out_path = path.replace(".txt", ".bow")
+            all_documents.append(f.readlines())
+    documents = [doc for file_docs in all_documents for doc in file_docs]
+
+    # Merges, vocabulary en IDF uit een eerder model, of opnieuw leren:
+    vectorizer = load_or_fit(args, lambda v: v.fit(documents), lambda: documents)
+    vocabulary = vectorizer.vocabulary
+
+    matrix = vectorizer.transform(documents, args.encoding)
+    idf = vectorizer.idf if args.encoding == "tfidf" else None
+
+    start = 0
+    for path, file_docs in zip(args.filepath, all_documents):
+        file_matrix = matrix[start:start + len(file_docs)]
+        start += len(file_docs)
+        out_path = bow_output_path(path)
+
+        if not args.text:
+            save_bow(out_path, file_matrix, vocabulary, args.encoding, idf)
+            print(f"Bag of words met het bestand: {path}")
+            print(f"{file_matrix.shape[0]} documenten x {file_matrix.shape[1]} tokens, "
+                  f"{file_matrix.nnz} waarden ({args.encoding})")
+            print(f"BOW succesvol geschreven naar {out_path}")
+            continue
+
+        vectors = [row.tolist() for row in file_matrix.toarray()]
         write_to_bow(vocabulary, vectors, out_path)
         print(f"Bag of words met het bestand: {path}")
         print(f"Vocabulary: {vocabulary}\n")
@@ -0,0 +1,421 @@
+"""
+benchmark.py — snelheid en geheugen van de verschillende stappen meten.
+
+Gebruik:
+    python benchmark.py bpe ongebruikte_scripts/cancer_cause_and_treatment.txt --min-freq 3
+    python benchmark.py decode ongebruikte_scripts/cancer_cause_and_treatment.txt encoding.enc --size-mb 100
+    python benchmark.py enc encoding.enc
+    python benchmark.py ngram encoding.enc --orders 2 3 5 50
+    python benchmark.py generate encoding.enc --length 10000
+    python benchmark.py cbow encoding.enc -w 2
+    python benchmark.py embed encoding.enc --workers 1 2 4 8
+    python benchmark.py bow corpus.txt --encoding tfidf
+    python benchmark.py hashed corpus.txt --ngram 2
+"""
+
+import argparse
+import os
+import pickle
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from nlp import (file_reader, tokenizer, sort_and_return_token,
+                 byte_pair_encoding, count_words, read_word_counts, BPETrainer,
+                 load_encoding, encoding_id_to_token, WordEncoder, tokens_to_ids,
+                 flatten_token_lists, save_token_ids, save_encoding,
+                 train_ngram_model, NgramModel, encoding_token_ids, count_ngrams,
+                 make_cbow_examples_ids, make_cbow_examples_sparse, EmbeddingTrainer,
+                 document_term_matrix, multi_hot_matrix, tfidf_matrix,
+                 BagOfWordsVectorizer, HashingVectorizer, learn_merges)
+import tokenizer as tokenizer_script
+import ngram as ngram_script
+import bagofwords as bow_script
+
+
+def measure(func, *args):
+    """
+    Voer func uit en meet de tijd en het piekgeheugen.
+    tracemalloc maakt alles trager, dus het geheugen wordt in een tweede run gemeten.
+
+    :return result, seconden, piekgeheugen in MB
+    """
+    start = time.perf_counter()
+    result = func(*args)
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, peak / 1e6
+
+
+def report(name, seconds, peak_mb, baseline=None):
+    speedup = f"  ({baseline / seconds:.1f}x)" if baseline else ""
+    print(f"{name:<36} {seconds:>9.3f} s {peak_mb:>9.1f} MB{speedup}")
+
+
+def report_throughput(name, seconds, mb):
+    print(f"{name:<36} {seconds:>9.3f} s {mb / seconds:>9.1f} MB/s")
+
+
+def bpe_old(txt_path, min_freq, max_merges):
+    word_list = file_reader(txt_path)
+    merges = []
+    for _ in range(max_merges):
+        pair = sort_and_return_token(tokenizer(word_list), min_freq)
+        if pair is None:
+            break
+        merges.append(pair)
+        word_list = byte_pair_encoding(word_list, pair)
+    return merges
+
+
+def bpe_per_word(txt_path, min_freq, max_merges):
+    trainer = BPETrainer(file_reader(txt_path))
+    return trainer.train(min_freq, max_merges)
+
+
+def bpe_word_counts(txt_path, min_freq, max_merges, workers=1):
+    words, freqs, _ = read_word_counts(txt_path)
+    trainer = BPETrainer(words, freqs, workers)
+    return trainer.train(min_freq, max_merges)
+
+
+def bench_bpe(args):
+    words, freqs, word_ids = count_words(file_reader(args.path))
+    print(f"{len(word_ids)} woorden, {len(words)} uniek "
+          f"(type/token ratio {len(words) / len(word_ids):.3f})\n")
+
+    runs = [("BPETrainer (woord-counts)", bpe_word_counts),
+            ("BPETrainer (per woord)", bpe_per_word)]
+    if args.workers > 1:
+        runs.insert(0, (f"BPETrainer ({args.workers} workers)",
+                        lambda *a: bpe_word_counts(*a, workers=args.workers)))
+    if not args.skip_old:
+        runs.append(("tokenizer() + byte_pair_encoding()", bpe_old))
+
+    results = []
+    for name, func in runs:
+        merges, seconds, peak = measure(func, args.path, args.min_freq, args.max_merges)
+        results.append((name, merges, seconds, peak))
+
+    baseline = results[-1][2]
+    for name, merges, seconds, peak in results:
+        report(name, seconds, peak, baseline)
+    same = all(merges == results[0][1] for _, merges, _, _ in results)
+    print(f"\n{len(results[0][1])} merges, gelijk: {same}")
+
+
+def bench_decode(args):
+    enc_db = load_encoding(args.enc_path)
+    id_to_token = encoding_id_to_token(enc_db)
+    token_to_id = {tok: i for i, tok in enumerate(id_to_token)}
+    tokens = flatten_token_lists(WordEncoder(enc_db["merges"]).encode_words(file_reader(args.path)))
+    token_ids = np.array(tokens_to_ids(tokens, token_to_id))
+
+    # Herhaal de tekst tot de gevraagde grootte:
+    text_mb = len("".join(tokens).encode("utf-8")) / 1e6
+    repeat = max(1, int(args.size_mb / text_mb))
+    token_ids = np.tile(token_ids, repeat)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tok_path = os.path.join(tmp, "bench.tok")
+        save_token_ids(tok_path, token_ids, id_to_token)
+        print(f"{len(token_ids)} tokens, .tok {os.path.getsize(tok_path) / 1e6:.1f} MB, "
+              f"tekst {text_mb * repeat:.1f} MB\n")
+
+        start = time.perf_counter()
+        tokenizer_script.decode_tokens(tok_path, args.enc_path)
+        seconds = time.perf_counter() - start
+        report_throughput("ID-tabel decoder", seconds, text_mb * repeat)
+
+        if not args.skip_old:
+            with open(tok_path, "w") as f:
+                f.write("".join(tokens) * repeat)
+            start = time.perf_counter()
+            tokenizer_script.decode_tokens(tok_path, args.enc_path)
+            old_seconds = time.perf_counter() - start
+            report_throughput("reverse_merge decoder", old_seconds, text_mb * repeat)
+
+
+def time_load(func, path, repeat=5):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(path)
+    return (time.perf_counter() - start) / repeat
+
+
+def bench_enc(args):
+    enc_db = load_encoding(args.enc_path)
+    db = {"vocabulary": set(enc_db["vocabulary"]), "text_tokens": enc_db["text_tokens"],
+          "merges": list(enc_db.get("merges") or [])}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pickle_path = os.path.join(tmp, "pickle.enc")
+        container_path = os.path.join(tmp, "container.enc")
+        with open(pickle_path, "wb") as f:
+            pickle.dump(db, f)
+        save_encoding(db["vocabulary"], db["text_tokens"], container_path, db["merges"])
+        print(f"pickle    {os.path.getsize(pickle_path) / 1e3:>9.1f} KB")
+        print(f"container {os.path.getsize(container_path) / 1e3:>9.1f} KB\n")
+
+        def load_pickle(path):
+            with open(path, "rb") as f:
+                return pickle.load(f)
+
+        runs = [
+            ("container: vocabulary", lambda p: load_encoding(p)["vocabulary"]),
+            ("container: merges", lambda p: load_encoding(p)["merges"]),
+            ("container: text_ids", lambda p: load_encoding(p)["text_ids"]),
+            ("container: alles", lambda p: dict(load_encoding(p))),
+        ]
+        baseline = time_load(load_pickle, pickle_path)
+        for name, func in runs:
+            seconds = time_load(func, container_path)
+            print(f"{name:<36} {seconds * 1000:>9.2f} ms  ({baseline / seconds:.1f}x)")
+        print(f"{'pickle.load':<36} {baseline * 1000:>9.2f} ms  (1.0x)")
+
+
+def dict_model_size(token_list, n):
+    """
+    Bouw train_ngram_model() en meet hoeveel geheugen het resultaat inneemt.
+    """
+    tracemalloc.start()
+    model = train_ngram_model(token_list, n)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return model, size
+
+
+def bench_ngram(args):
+    token_ids = encoding_token_ids(load_encoding(args.enc_path))
+    token_list = token_ids.tolist()
+    print(f"{len(token_ids)} tokens\n")
+    print(f"{'n':>3} {'contexten':>10} {'dict s':>9} {'dict MB':>9} "
+          f"{'NgramModel s':>13} {'NgramModel MB':>14} {'count_ngrams s':>15} {'gelijk':>7}")
+    for n in args.orders:
+        start = time.perf_counter()
+        model = train_ngram_model(token_list, n)
+        dict_seconds = time.perf_counter() - start
+        _, dict_bytes = dict_model_size(token_list, n)
+
+        start = time.perf_counter()
+        ngram_model = NgramModel(n).fit(token_ids)
+        seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        table = count_ngrams(token_ids, n)
+        count_seconds = time.perf_counter() - start
+        same = NgramModel.from_counts(*table).to_dict() == model
+        del model
+        print(f"{n:>3} {ngram_model.n_contexts:>10} {dict_seconds:>9.3f} {dict_bytes / 1e6:>9.1f} "
+              f"{seconds:>13.3f} {ngram_model.nbytes() / 1e6:>14.1f} {count_seconds:>15.3f} {same!s:>7}")
+
+
+def bench_generate(args):
+    enc_db = load_encoding(args.enc_path)
+    token_ids = encoding_token_ids(enc_db)
+    id_to_token = encoding_id_to_token(enc_db)
+    rng = np.random.default_rng(0)
+
+    dict_model = train_ngram_model([id_to_token[i] for i in token_ids.tolist()], args.n)
+    start = time.perf_counter()
+    dict_text = ngram_script.generate_text(dict_model, args.n, args.length)
+    dict_seconds = time.perf_counter() - start
+
+    model = NgramModel(args.n).fit(token_ids)
+    start = time.perf_counter()
+    model.prepare_sampling()
+    prepare_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    text = ngram_script.generate_text(model, args.n, args.length, id_to_token, rng)
+    seconds = time.perf_counter() - start
+
+    # Generatie stopt bij een onbekende context, dus ook het aantal tekens tonen:
+    print(f"{'dict + np.random.choice':<36} {dict_seconds:>9.3f} s {len(dict_text):>9} tekens")
+    print(f"{'NgramModel + cumulatieve counts':<36} {seconds:>9.3f} s {len(text):>9} tekens"
+          f"  ({dict_seconds / seconds:.1f}x)")
+    print(f"{'(eenmalig prepare_sampling)':<36} {prepare_seconds:>9.3f} s")
+
+
+def bench_cbow(args):
+    token_ids = encoding_token_ids(load_encoding(args.enc_path))
+    token_list = token_ids.tolist()
+    print(f"{len(token_ids)} tokens, vocab {int(token_ids.max()) + 1}\n")
+
+    (x, _, _), seconds, peak = measure(make_cbow_examples_ids, token_list, args.window)
+    report("dichte multi-hot rijen", seconds, peak)
+    print(f"{'(x)':<36} {x.nbytes / 1e6:>21.1f} MB")
+    del x
+
+    (x, _, _), sparse_seconds, sparse_peak = measure(make_cbow_examples_sparse,
+                                                   token_ids, args.window)
+    report("scipy.sparse CSR", sparse_seconds, sparse_peak, seconds)
+    x_bytes = x.data.nbytes + x.indices.nbytes + x.indptr.nbytes
+    print(f"{'(x)':<36} {x_bytes / 1e6:>21.1f} MB")
+
+
+def bench_embed(args):
+    enc_db = load_encoding(args.enc_path)
+    token_ids = encoding_token_ids(enc_db)
+    vocab_size = len(encoding_id_to_token(enc_db))
+    print(f"{len(token_ids)} tokens, {os.cpu_count()} cores\n")
+    print(f"{'workers':>7} {'tokens/s':>12} {'speedup':>8} {'efficiëntie':>12}")
+
+    single = None
+    for workers in args.workers:
+        trainer = EmbeddingTrainer(vocab_size, args.dim, mode=args.mode, seed=0)
+        trainer.fit(token_ids, args.epochs, workers=workers)
+        single = single or trainer.tokens_per_second
+        speedup = trainer.tokens_per_second / single
+        print(f"{workers:>7} {trainer.tokens_per_second:>12,.0f} {speedup:>7.2f}x "
+              f"{speedup / workers:>12.0%}")
+
+
+def bow_lists(docs, vocab_to_idx, encoding):
+    if encoding == "multi-hot":
+        return [bow_script.multi_hot(doc, vocab_to_idx) for doc in docs]
+    if encoding == "tfidf":
+        idf = bow_script.compute_idf(docs, vocab_to_idx)
+        return [bow_script.tf_idf_vector(doc, vocab_to_idx, idf) for doc in docs]
+    return [bow_script.count_encoding(doc, vocab_to_idx) for doc in docs]
+
+
+def bow_sparse(docs, vocab_to_idx, encoding):
+    doc_ids = [[vocab_to_idx[token] for token in doc if token in vocab_to_idx] for doc in docs]
+    counts = document_term_matrix(doc_ids, len(vocab_to_idx))
+    if encoding == "multi-hot":
+        return multi_hot_matrix(counts)
+    if encoding == "tfidf":
+        return tfidf_matrix(counts)
+    return counts
+
+
+def bench_bow(args):
+    with open(args.path, encoding="utf-8") as f:
+        documents = [bow_script.pre_process(line) for line in f]
+    words, freqs, _ = count_words([word for doc in documents for word in doc])
+    trainer = BPETrainer(words, freqs)
+    encoder = WordEncoder(trainer.train(args.min_freq))
+    docs = [bow_script.apply_bpe(doc, encoder) for doc in documents]
+    vocab_to_idx = {token: i for i, token in enumerate(sorted({t for doc in docs for t in doc}))}
+    print(f"{len(docs)} documenten, vocab {len(vocab_to_idx)}\n")
+
+    bow_sparse(docs[:1], vocab_to_idx, args.encoding)  # scipy importeren telt niet mee
+    vectors, seconds, peak = measure(bow_lists, docs, vocab_to_idx, args.encoding)
+    report("lijsten per document", seconds, peak)
+    matrix, sparse_seconds, sparse_peak = measure(bow_sparse, docs, vocab_to_idx, args.encoding)
+    report("scipy.sparse CSR", sparse_seconds, sparse_peak, seconds)
+    print(f"\ngelijk: {np.array_equal(matrix.toarray(), np.array(vectors))}")
+
+
+def bench_hashed(args):
+    with open(args.path, encoding="utf-8") as f:
+        documents = f.readlines()
+    mb = sum(len(doc.encode("utf-8")) for doc in documents) / 1e6
+    print(f"{len(documents)} documenten, {mb:.1f} MB\n")
+
+    start = time.perf_counter()
+    vectorizer = BagOfWordsVectorizer(min_freq=args.min_freq).fit(documents)
+    fit_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    merges, _ = learn_merges(documents, args.min_freq)
+    merge_seconds = time.perf_counter() - start
+    print(f"{'fit: merges + vocabulary + IDF':<36} {fit_seconds:>9.3f} s")
+    print(f"{'fit: alleen merges (hashed)':<36} {merge_seconds:>9.3f} s\n")
+
+    # Elke vectorizer begint met een lege woord-cache, zoals bij een nieuwe batch documenten:
+    runs = [
+        ("count", lambda: BagOfWordsVectorizer.load(model_path).transform(documents)),
+        ("tfidf", lambda: BagOfWordsVectorizer.load(model_path).transform(documents, "tfidf")),
+        (f"hashed ({args.n_features} buckets)",
+         lambda: HashingVectorizer(merges, args.n_features).transform(documents)),
+    ]
+    if args.ngram > 1:
+        runs.append((f"hashed + {args.ngram}-grams",
+                     lambda: HashingVectorizer(merges, args.n_features, args.ngram).transform(documents)))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_path = os.path.join(tmp, "model.bowvec")
+        vectorizer.save(model_path)
+        for name, func in runs:
+            start = time.perf_counter()
+            matrix = func()
+            seconds = time.perf_counter() - start
+            print(f"{name:<36} {seconds:>9.3f} s {len(documents) / seconds:>10,.0f} docs/s "
+                  f"{mb / seconds:>7.1f} MB/s  nnz {matrix.nnz}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("bpe", help="BPE training")
+    p.add_argument("path")
+    p.add_argument("--min-freq", type=int, default=3)
+    p.add_argument("--max-merges", type=int, default=9999)
+    p.add_argument("--skip-old", action="store_true",
+                   help="Sla de oude (trage) trainer over")
+    p.add_argument("--workers", type=int, default=1)
+    p.set_defaults(func=bench_bpe)
+
+    p = sub.add_parser("decode", help="Decoderen van een .tok bestand")
+    p.add_argument("path", help="Tekst om te encoderen")
+    p.add_argument("enc_path")
+    p.add_argument("--size-mb", type=float, default=50)
+    p.add_argument("--skip-old", action="store_true",
+                   help="Sla de oude decoder over")
+    p.set_defaults(func=bench_decode)
+
+    p = sub.add_parser("enc", help="Laden van .enc bestanden, pickle tegen container")
+    p.add_argument("enc_path")
+    p.set_defaults(func=bench_enc)
+
+    p = sub.add_parser("ngram", help="N-gram model: dict tegen NgramModel")
+    p.add_argument("enc_path")
+    p.add_argument("--orders", type=int, nargs="+", default=[2, 3, 5, 50])
+    p.set_defaults(func=bench_ngram)
+
+    p = sub.add_parser("generate", help="Tekst genereren met een n-gram model")
+    p.add_argument("enc_path")
+    p.add_argument("-n", type=int, default=3)
+    p.add_argument("--length", type=int, default=10000)
+    p.set_defaults(func=bench_generate)
+
+    p = sub.add_parser("cbow", help="CBOW dataset: dichte rijen tegen CSR")
+    p.add_argument("enc_path")
+    p.add_argument("-w", "--window", type=int, default=2)
+    p.set_defaults(func=bench_cbow)
+
+    p = sub.add_parser("embed", help="Embedding training: schaling met Hogwild workers")
+    p.add_argument("enc_path")
+    p.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4],
+                   help="Speedup en efficiëntie zijn ten opzichte van de eerste waarde")
+    p.add_argument("--mode", choices=["cbow", "skipgram"], default="skipgram")
+    p.add_argument("--dim", type=int, default=100)
+    p.add_argument("--epochs", type=int, default=1)
+    p.set_defaults(func=bench_embed)
+
+    p = sub.add_parser("bow", help="Bag of words: lijsten tegen sparse matrix")
+    p.add_argument("path", help="Tekst met een document per regel")
+    p.add_argument("--encoding", choices=["multi-hot", "count", "tfidf"], default="count")
+    p.add_argument("--min-freq", type=int, default=2)
+    p.set_defaults(func=bench_bow)
+
+    p = sub.add_parser("hashed", help="Bag of words: vocabulary tegen hashing trick")
+    p.add_argument("path", help="Tekst met een document per regel")
+    p.add_argument("--min-freq", type=int, default=2)
+    p.add_argument("--n-features", type=int, default=2**20)
+    p.add_argument("--ngram", type=int, default=2)
+    p.set_defaults(func=bench_hashed)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
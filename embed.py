@@ -3,16 +3,22 @@ embed.py — CBOW embeddings voor Floris/Mirte encoding.enc
 
 Gebruik:
     python embed.py encoding.enc -H 50 -w 2 -o kanker_nl.emb
+    python embed.py encoding.enc --tok kanker_nl.tok   (binaire .tok van tokenizer.py encode --ids)
+    python embed.py encoding.enc --trainer skipgram -H 100 --epochs 5   (negative sampling, zonder sklearn)
+    python embed.py encoding.enc --trainer cbow --workers 8   (Hogwild over 8 processen)
 """
 
 import argparse
 from nlp import (
     load_encoding,
     flatten_token_lists,
-    make_cbow_examples_ids,
+    encoding_id_to_token,
+    load_token_ids,
+    make_cbow_examples_sparse,
     train_cbow_mlp,
     extract_embeddings_from_mlp_ids,
     save_embeddings_with_vocab,
+    EmbeddingTrainer,
 )
 
 
@@ -22,6 +28,16 @@ def main():
     parser.add_argument("-w", "--window", type=int, default=2)
     parser.add_argument("-H", "--hidden", type=int, default=20)
     parser.add_argument("-o", "--output")
+    parser.add_argument("--tok", help="Binair .tok bestand met token-ID's, in plaats van de tekst in de .enc")
+    parser.add_argument("--trainer", choices=["mlp", "cbow", "skipgram"], default="mlp",
+                        help="mlp: sklearn MLP met softmax; cbow/skipgram: NumPy met negative sampling")
+    parser.add_argument("--epochs", type=int, default=5, help="Alleen voor cbow/skipgram")
+    parser.add_argument("--negative", type=int, default=5, help="Aantal negative samples per voorbeeld")
+    parser.add_argument("--subsample", type=float, default=1e-3,
+                        help="Drempel voor het wegfilteren van veel voorkomende tokens (0 = uit)")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Processen voor cbow/skipgram (Hogwild, gedeelde matrices)")
 
     args = parser.parse_args()
     enc_path = args.enc_file
@@ -32,21 +48,36 @@ def main():
     print(f"[INFO] Laad encoding: {enc_path}")
     enc = load_encoding(enc_path)
 
-    vocab_list = sorted(enc["vocabulary"])
+    vocab_list = encoding_id_to_token(enc)
     token_to_id = {tok: i for i, tok in enumerate(vocab_list)}
 
-    print("[INFO] Flatten tokens -> ID's")
-    flat = flatten_token_lists(enc["text_tokens"])
-    token_ids = [token_to_id[t] for t in flat]
-
-    print("[INFO] CBOW dataset bouwen...")
-    X, y, _ = make_cbow_examples_ids(token_ids, args.window)
-
-    print(f"[INFO] Train MLP (hidden={args.hidden})...")
-    clf = train_cbow_mlp(X, y, args.hidden)
-
-    print("[INFO] Extract embeddings...")
-    id_to_vec = extract_embeddings_from_mlp_ids(clf)
+    if args.tok:
+        print(f"[INFO] Laad token-ID's: {args.tok}")
+        token_ids = load_token_ids(args.tok, vocab_list)
+    elif "text_ids" in enc:
+        token_ids = enc["text_ids"]
+    else:
+        print("[INFO] Flatten tokens -> ID's")
+        flat = flatten_token_lists(enc["text_tokens"])
+        token_ids = [token_to_id[t] for t in flat]
+
+    if args.trainer == "mlp":
+        print("[INFO] CBOW dataset bouwen...")
+        X, y, _ = make_cbow_examples_sparse(token_ids, args.window)
+
+        print(f"[INFO] Train MLP (hidden={args.hidden})...")
+        clf = train_cbow_mlp(X, y, args.hidden)
+
+        print("[INFO] Extract embeddings...")
+        id_to_vec = extract_embeddings_from_mlp_ids(clf)
+    else:
+        print(f"[INFO] Train {args.trainer} (dim={args.hidden}, epochs={args.epochs}, "
+              f"workers={args.workers})...")
+        trainer = EmbeddingTrainer(len(vocab_list), args.hidden, args.window, args.trainer,
+                                   args.negative, args.subsample, seed=args.seed)
+        trainer.fit(token_ids, args.epochs, verbose=True, workers=args.workers)
+        print(f"[INFO] {trainer.tokens_per_second:,.0f} tokens/s")
+        id_to_vec = trainer.embeddings()
 
     print(f"[INFO] Opslaan naar {emb_path}")
     save_embeddings_with_vocab(emb_path, id_to_vec, vocab_list)
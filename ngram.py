@@ -10,21 +10,46 @@ import sys
 import pickle
 import random
 from collections import Counter, defaultdict
-from nlp import load_encoding, flatten_token_lists, train_ngram_model
+from nlp import (load_encoding, flatten_token_lists, NgramModel, KneserNeyModel,
+                 encoding_id_to_token, encoding_token_ids, load_token_ids, count_ngrams_shards)
 
 def input_parser():
     """
     Verkrijg commandline argumenten:
     """
     
-    pickle_path = None
+    options = {"-n": 3, "--samples": 1, "--length": 100, "--seed": None, "--output": None,
+               "--workers": 1}
+    for flag in options:
+        if flag in sys.argv:
+            i = sys.argv.index(flag)
+            options[flag] = sys.argv[i + 1] if flag == "--output" else int(sys.argv[i + 1])
+            del sys.argv[i:i + 2]
+
+    action = "run"
+    paths = []
     if(len(sys.argv) > 1):
         if(sys.argv[1] == "-h" or sys.argv[1] == "--help"):
-            print("Gebruik: python ngram.py pad_naar_pickle")
+            print("""Gebruik:
+        python ngram.py [pad_naar_pickle] [-n N] [generatie opties]
+        python ngram.py train <enc_path> <model_path> [shard.tok ...] [-n N] [--workers W]
+        python ngram.py generate <model_path> [generatie opties]
+        python ngram.py perplexity <enc_path> [held_out.tok] [-n N]
+
+        train met shards: tel de n-grams per binaire .tok shard (tokenizer.py encode --ids)
+        in W processen en voeg de counts samen; de .enc levert alleen de vocabulary.
+
+        perplexity: Kneser-Ney perplexity voor de orden 1..N op een binaire .tok
+        (tokenizer.py encode --ids), of op de laatste 10% van de trainingstekst.
+
+        Generatie opties: [--samples K] [--length L] [--seed S] [--output samples.npz]""")
             sys.exit()
+        elif sys.argv[1] in ("train", "generate", "perplexity"):
+            action = sys.argv[1]
+            paths = sys.argv[2:]
         else:
-            pickle_path = sys.argv[1]
-    return pickle_path
+            paths = sys.argv[1:2]
+    return action, paths, options
 
 
 def file_reader(pickle_path):
@@ -45,7 +70,29 @@ def file_reader(pickle_path):
 
 
 
-def generate_text(model, n, length):
+def generate_samples(model, n_samples, length, seed=None, output_path=None):
+    """
+    Genereer n_samples samples tegelijk en sla ze op als token-ID arrays (.npz met
+    'samples' en 'lengths', zie NgramModel.generate_batch).
+    """
+    samples, lengths = model.generate_batch(n_samples, length, np.random.default_rng(seed))
+    if output_path:
+        np.savez(output_path, samples=samples, lengths=lengths)
+    return samples, lengths
+
+
+def generate_text(model, n, length, id_to_token=None, rng=None):
+    """
+    Genereer tekst met een n-gram model.
+
+    :param model: een NgramModel, of een dict van train_ngram_model().
+    :param id_to_token: lijst id -> token, nodig bij een NgramModel.
+    :param rng: numpy Generator, alleen gebruikt bij een NgramModel.
+    """
+    if isinstance(model, NgramModel):
+        # De cumulatieve counts worden één keer berekend, daarna is elk token een binary search:
+        model.prepare_sampling()
+        return "".join(id_to_token[i] for i in model.generate(length, rng))
 
     # Random start binnen de text:
     current_context = random.choice(list(model.keys()))
@@ -68,12 +115,65 @@ def generate_text(model, n, length):
     return "".join(output)
 
 
-if __name__ == "__main__":
-    pickle_path = input_parser()
-    vocabulary_list, story_token_list = file_reader(pickle_path)
+def train(enc_path, model_path, n, shard_paths=(), workers=1):
+    """
+    Train een n-gram model en sla het op, zodat generate het direct kan openen.
 
-    model = train_ngram_model(story_token_list, n=3)
+    :param shard_paths: binaire .tok bestanden; als die er zijn wordt daarop getraind
+        in plaats van op de tekst in de .enc.
+    """
+    db = load_encoding(enc_path)
+    if shard_paths:
+        model = NgramModel.from_counts(*count_ngrams_shards(shard_paths, n, workers,
+                                                            id_to_token=encoding_id_to_token(db)))
+    else:
+        model = NgramModel(n).fit(encoding_token_ids(db))
+    model.save(model_path, encoding_id_to_token(db))
+    print(f"Model (n={n}, {model.n_contexts} contexten) opgeslagen in '{model_path}'.")
+
+
+def generate(model, id_to_token, options):
+    if options["--samples"] > 1 or options["--output"]:
+        samples, lengths = generate_samples(model, options["--samples"], options["--length"],
+                                            options["--seed"], options["--output"])
+        if options["--output"]:
+            print(f"{len(samples)} samples opgeslagen in '{options['--output']}'.")
+        print("".join(id_to_token[i] for i in samples[0, :lengths[0]]))
+    else:
+        generated_text = generate_text(model, n=model.n, length=options["--length"],
+                                       id_to_token=id_to_token,
+                                       rng=np.random.default_rng(options["--seed"]))
+        print(generated_text)
+
+
+def evaluate(enc_path, tok_path, max_n):
+    """
+    Print de Kneser-Ney perplexity op held-out tekst voor n = 1..max_n.
+    """
+    db = load_encoding(enc_path)
+    id_to_token = encoding_id_to_token(db)
+    token_ids = encoding_token_ids(db)
+    if tok_path:
+        train_ids, held_out = token_ids, load_token_ids(tok_path, id_to_token)
+    else:
+        split = int(len(token_ids) * 0.9)
+        train_ids, held_out = token_ids[:split], token_ids[split:]
+
+    for n in range(1, max_n + 1):
+        model = KneserNeyModel(n).fit(train_ids, len(id_to_token))
+        print(f"n={n}: perplexity {model.perplexity(held_out):.2f}")
 
-    generated_text = generate_text(model, n=3, length=100)
-    print(generated_text)
- 
\ No newline at end of file
+
+if __name__ == "__main__":
+    action, paths, options = input_parser()
+    if action == "train":
+        train(paths[0], paths[1], options["-n"], paths[2:], options["--workers"])
+    elif action == "generate":
+        model, id_to_token = NgramModel.load(paths[0])
+        generate(model, id_to_token, options)
+    elif action == "perplexity":
+        evaluate(paths[0], paths[1] if len(paths) > 1 else None, options["-n"])
+    else:
+        db = load_encoding(paths[0] if paths else "encoding.enc")
+        model = NgramModel(n=options["-n"]).fit(encoding_token_ids(db))
+        generate(model, encoding_id_to_token(db), options)
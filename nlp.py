@@ -1,9 +1,21 @@
+import bisect
+import copy
+import functools
+import hashlib
+import heapq
+import json
+import os
 import pickle
+import shutil
+import struct
+import tempfile
+import time
 from collections import Counter, defaultdict
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 import numpy as np
 
-from sklearn.neural_network import MLPClassifier
-
 def train_ngram_model(story_token_list, n=3):
     """
     Returns: Geneste dictionary {(ngram): {next_token: probability}}
@@ -28,6 +40,610 @@ def train_ngram_model(story_token_list, n=3):
 
     return model
 
+
+FNV_OFFSET = np.uint64(14695981039346656037)
+FNV_PRIME = np.uint64(1099511628211)
+
+
+def hash_contexts(columns, n_rows=1):
+    """
+    64-bit FNV-1a hash van contexten, gevectoriseerd over alle contexten tegelijk.
+
+    :param columns: lijst met arrays, kolom c bevat het c-de token van elke context.
+    :param n_rows: aantal contexten, alleen nodig als er geen kolommen zijn (n = 1).
+    :return hashes: uint64 array met een hash per context.
+    """
+    n_rows = len(columns[0]) if columns else n_rows
+    hashes = np.full(n_rows, FNV_OFFSET, dtype=np.uint64)
+    for column in columns:
+        hashes ^= np.asarray(column, dtype=np.uint64)
+        hashes *= FNV_PRIME
+    return hashes
+
+
+NGRAM_MAGIC = b"NGRAM\x00\x00\x00"
+NGRAM_VERSION = 1
+NGRAM_ARRAYS = ["tokens", "context_pos", "offsets", "next_ids", "counts", "hash_keys",
+                "hash_order", "cumulative", "next_context"]
+
+
+class NgramModel:
+    """
+    N-gram model dat alleen integer counts opslaat, in platte numpy arrays.
+
+    - tokens: de trainingstekst als token-ID's (2 bytes per token)
+    - context_pos: per unieke context de positie van het eerste voorkomen in tokens
+    - offsets, next_ids, counts: per context (CSR-achtig) de volgende tokens en hun counts
+    - hash_keys, hash_order: gesorteerde context-hashes om een context op te zoeken
+
+    Een context wordt gevonden via de hash en daarna vergeleken met de tokens op
+    context_pos, dus een hash-botsing geeft geen verkeerd antwoord.
+    Kansen worden pas berekend als ze opgevraagd worden.
+    """
+
+    def __init__(self, n=3):
+        self.n = n
+        self.context_size = n - 1
+
+    def fit(self, token_ids):
+        """
+        Tel alle n-grams in een array met token-ID's.
+
+        Geeft dezelfde counts als train_ngram_model(), maar door te sorteren in plaats
+        van met een dict per context.
+        """
+        self.tokens = np.ascontiguousarray(token_ids)
+        n_windows = len(self.tokens) - self.context_size
+        if n_windows <= 0:
+            raise ValueError("Tekst is korter dan n.")
+
+        positions = np.arange(n_windows)
+        # Sorteer alle posities op (context, volgend token), eerste kolom belangrijkst:
+        columns = [self.tokens[c:c + n_windows] for c in range(self.n)]
+        order = np.lexsort(columns[::-1])
+
+        new_context = np.zeros(n_windows, dtype=bool)
+        new_context[0] = True
+        for column in columns[:-1]:
+            col = column[order]
+            new_context[1:] |= col[1:] != col[:-1]
+        next_sorted = columns[-1][order]
+        new_entry = new_context.copy()
+        new_entry[1:] |= next_sorted[1:] != next_sorted[:-1]
+
+        entry_starts = np.flatnonzero(new_entry)
+        self.next_ids = next_sorted[entry_starts]
+        self.counts = np.diff(np.append(entry_starts, n_windows)).astype(np.uint32)
+
+        # lexsort is stabiel, dus het eerste element van elke groep is het eerste voorkomen:
+        context_starts = np.flatnonzero(new_context)
+        self.context_pos = positions[order[context_starts]].astype(np.int64)
+        self.offsets = np.searchsorted(entry_starts, np.append(context_starts, n_windows))
+
+        self._build_hash_index()
+        return self
+
+    def _build_hash_index(self):
+        columns = [self.tokens[self.context_pos + c] for c in range(self.context_size)]
+        hashes = hash_contexts(columns, self.n_contexts)
+        self.hash_order = np.argsort(hashes, kind="stable")
+        self.hash_keys = hashes[self.hash_order]
+
+    @classmethod
+    def from_counts(cls, ngrams, counts):
+        """
+        Bouw een model uit een count-tabel van count_ngrams() / merge_ngram_counts(),
+        zonder de oorspronkelijke tekst. De unieke contexten worden achter elkaar
+        opgeslagen in tokens, zodat de rest van het model hetzelfde werkt.
+
+        :param ngrams: 2D array, een uniek n-gram per rij, lexicografisch gesorteerd.
+        :param counts: count per n-gram.
+        """
+        if not len(ngrams):
+            raise ValueError("Geen n-grams om een model van te bouwen: de tekst is korter dan n tokens.")
+        model = cls(ngrams.shape[1])
+        contexts = ngrams[:, :model.context_size]
+        new_context = np.zeros(len(ngrams), dtype=bool)
+        new_context[0] = True
+        for c in range(model.context_size):
+            new_context[1:] |= contexts[1:, c] != contexts[:-1, c]
+        context_starts = np.flatnonzero(new_context)
+
+        model.tokens = np.ascontiguousarray(contexts[context_starts]).reshape(-1)
+        model.context_pos = np.arange(len(context_starts), dtype=np.int64) * model.context_size
+        model.offsets = np.append(context_starts, len(ngrams))
+        model.next_ids = np.ascontiguousarray(ngrams[:, -1])
+        model.counts = counts.astype(np.uint32 if counts.max() < 2**32 else np.uint64)
+        model._build_hash_index()
+        return model
+
+    @property
+    def n_contexts(self):
+        return len(self.context_pos)
+
+    def context(self, index):
+        """
+        Geef de context met dit nummer als tuple van token-ID's.
+        """
+        pos = int(self.context_pos[index])
+        return tuple(self.tokens[pos:pos + self.context_size].tolist())
+
+    def context_index(self, context):
+        """
+        Zoek het nummer van een context (reeks token-ID's), of -1 als hij niet bestaat.
+        """
+        context = tuple(int(t) for t in context[len(context) - self.context_size:])
+        if len(context) != self.context_size:
+            return -1
+        key = hash_contexts([[t] for t in context])[0]
+        i = np.searchsorted(self.hash_keys, key)
+        while i < len(self.hash_keys) and self.hash_keys[i] == key:
+            index = int(self.hash_order[i])
+            if self.context(index) == context:
+                return index
+            i += 1
+        return -1
+
+    def context_indices(self, contexts):
+        """
+        Gevectoriseerde context_index() voor een 2D array met een context per rij.
+        """
+        contexts = np.asarray(contexts).reshape(len(contexts), self.context_size)
+        keys = hash_contexts([contexts[:, c] for c in range(self.context_size)], len(contexts))
+        i = np.minimum(np.searchsorted(self.hash_keys, keys), len(self.hash_keys) - 1)
+        indices = np.where(self.hash_keys[i] == keys, self.hash_order[i], -1)
+
+        # Controleer of de gevonden context echt gelijk is (hash-botsingen):
+        found = indices >= 0
+        pos = self.context_pos[indices[found]]
+        for c in range(self.context_size):
+            mismatch = np.flatnonzero(found)[self.tokens[pos + c] != contexts[found, c]]
+            indices[mismatch] = -1
+        # Bij een botsing kan de juiste context een paar plekken verder staan:
+        for row in np.flatnonzero(found & (indices < 0)):
+            indices[row] = self.context_index(contexts[row])
+        return indices
+
+    def next_token_counts(self, context):
+        """
+        :return next_ids, counts: volgende tokens en hun counts, of None voor een onbekende context.
+        """
+        index = context if isinstance(context, (int, np.integer)) else self.context_index(context)
+        if index < 0:
+            return None
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return self.next_ids[start:end], self.counts[start:end]
+
+    def next_token_probabilities(self, context):
+        """
+        :return next_ids, probabilities: zelfde als een rij uit train_ngram_model(), of None.
+        """
+        result = self.next_token_counts(context)
+        if result is None:
+            return None
+        next_ids, counts = result
+        return next_ids, counts / counts.sum()
+
+    def probability(self, context, token):
+        result = self.next_token_probabilities(context)
+        if result is None:
+            return 0.0
+        next_ids, probabilities = result
+        match = np.flatnonzero(next_ids == token)
+        return float(probabilities[match[0]]) if len(match) else 0.0
+
+    def prepare_sampling(self):
+        """
+        Bereken eenmalig alles wat nodig is om snel te samplen:
+        - cumulative: cumulatieve counts, per context oplopend
+        - next_context: per (context, volgend token) het nummer van de volgende context
+
+        Daarna kost elk gegenereerd token alleen een binary search.
+        """
+        if hasattr(self, "cumulative"):
+            return self
+        self.cumulative = np.cumsum(self.counts, dtype=np.uint64)
+
+        if self.context_size == 0:
+            self.next_context = np.zeros(len(self.next_ids), dtype=np.int64)
+        else:
+            entry_context = np.repeat(np.arange(self.n_contexts), np.diff(self.offsets))
+            entry_pos = self.context_pos[entry_context]
+            rows = np.column_stack([self.tokens[entry_pos + c] for c in range(1, self.context_size)]
+                                   + [self.next_ids])
+            self.next_context = self.context_indices(rows)
+        return self
+
+    def _sampling_lists(self):
+        """
+        cumulative, offsets, next_ids en next_context voor de sample-loop. Pas gebouwd
+        bij het eerste sample, zodat bijvoorbeeld save() geen lijsten aanmaakt.
+        """
+        if not hasattr(self, "_lists"):
+            self.prepare_sampling()
+            arrays = (self.cumulative, self.offsets, self.next_ids, self.next_context)
+            if isinstance(self.counts, np.memmap):
+                # Een gememory-mapt model niet helemaal inlezen, bisect werkt ook op arrays:
+                self._lists = arrays
+            else:
+                # Python lijsten zijn sneller dan numpy voor losse opzoekingen in de sample-loop:
+                self._lists = tuple(a.tolist() for a in arrays)
+        return self._lists
+
+    def _sample_entry(self, index, u):
+        cumulative, offsets, _, _ = self._sampling_lists()
+        start, end = int(offsets[index]), int(offsets[index + 1])
+        base = int(cumulative[start - 1]) if start else 0
+        target = base + int(u * (int(cumulative[end - 1]) - base))
+        return bisect.bisect_right(cumulative, target, start, end)
+
+    def sample_next(self, index, rng):
+        """
+        Trek een volgend token na context nummer index, met een binary search
+        in de cumulatieve counts in plaats van np.random.choice met kansen.
+        """
+        next_ids = self._sampling_lists()[2]
+        return int(next_ids[self._sample_entry(index, rng.random())])
+
+    def generate(self, length, rng=None, start=None):
+        """
+        Genereer token-ID's: begin bij een willekeurige context en stop bij een onbekende context.
+
+        :param length: aantal tokens om te genereren (na de start-context).
+        :param rng: numpy Generator, voor reproduceerbare uitvoer.
+        :param start: nummer van de start-context, standaard willekeurig.
+        :return output: lijst met token-ID's, inclusief de start-context.
+        """
+        _, _, next_ids, next_context = self._sampling_lists()
+        rng = rng if rng is not None else np.random.default_rng()
+        index = int(rng.integers(self.n_contexts)) if start is None else start
+        output = list(self.context(index))
+        for u in rng.random(length).tolist():
+            entry = self._sample_entry(index, u)
+            output.append(int(next_ids[entry]))
+            index = int(next_context[entry])
+            if index < 0:
+                break
+        return output
+
+    def generate_batch(self, n_samples, length, rng=None):
+        """
+        Genereer n_samples onafhankelijke samples tegelijk, gevectoriseerd over de samples.
+
+        Omdat de counts > 0 zijn is cumulative strikt stijgend, dus één searchsorted
+        over de hele array vindt voor alle samples tegelijk het juiste volgende token.
+
+        :param n_samples: aantal samples.
+        :param length: aantal tokens per sample (na de start-context).
+        :param rng: numpy Generator, voor reproduceerbare uitvoer.
+        :return samples, lengths: array (n_samples, context_size + length) met token-ID's en
+            per sample het aantal geldige tokens (een sample stopt bij een onbekende context).
+        """
+        self.prepare_sampling()
+        rng = rng if rng is not None else np.random.default_rng()
+
+        index = rng.integers(self.n_contexts, size=n_samples)
+        samples = np.zeros((n_samples, self.context_size + length), dtype=self.tokens.dtype)
+        pos = self.context_pos[index]
+        for c in range(self.context_size):
+            samples[:, c] = self.tokens[pos + c]
+        lengths = np.full(n_samples, self.context_size + length, dtype=np.int64)
+        alive = np.ones(n_samples, dtype=bool)
+
+        cumulative = self.cumulative
+        for step in range(length):
+            u = rng.random(n_samples)
+            start = self.offsets[index]
+            end = self.offsets[index + 1]
+            base = np.where(start > 0, cumulative[start - 1], 0)
+            total = cumulative[end - 1] - base
+            target = base + (u * total).astype(np.uint64)
+            entry = np.searchsorted(cumulative, target, side="right")
+
+            samples[alive, self.context_size + step] = self.next_ids[entry[alive]]
+            index = self.next_context[entry]
+            stopped = alive & (index < 0)
+            lengths[stopped] = self.context_size + step + 1
+            alive &= ~stopped
+            if not alive.any():
+                break
+            # Gestopte samples lopen mee op context 0, hun uitvoer wordt genegeerd:
+            index[~alive] = 0
+        return samples, lengths
+
+    def save(self, path, id_to_token=None):
+        """
+        Sla het model op als container met een array per sectie, inclusief de
+        sample-tabellen, zodat load() direct kan genereren zonder iets te berekenen.
+
+        :param id_to_token: optioneel, wordt mee opgeslagen zodat het model los bruikbaar is.
+        """
+        self.prepare_sampling()
+        sections = [json_section("meta", {"n": self.n})]
+        if id_to_token is not None:
+            sections.append(json_section("id_to_token", list(id_to_token)))
+        for name in NGRAM_ARRAYS:
+            sections.append(array_section(name, getattr(self, name)))
+        write_container(path, NGRAM_MAGIC, NGRAM_VERSION, sections)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Open een opgeslagen model. De arrays worden gememory-mapt, niet ingelezen.
+
+        :return model, id_to_token: id_to_token is None als die niet is opgeslagen.
+        """
+        sections = read_container_table(path, NGRAM_MAGIC, NGRAM_VERSION)
+        model = cls(read_section(path, sections, "meta")["n"])
+        for name in NGRAM_ARRAYS:
+            setattr(model, name, read_section(path, sections, name, mmap=True))
+        id_to_token = read_section(path, sections, "id_to_token") if "id_to_token" in sections else None
+        return model, id_to_token
+
+    def to_dict(self):
+        """
+        Het model als geneste dict, zelfde formaat als train_ngram_model().
+        """
+        model = {}
+        for index in range(self.n_contexts):
+            next_ids, probabilities = self.next_token_probabilities(index)
+            model[self.context(index)] = dict(zip(next_ids.tolist(), probabilities.tolist()))
+        return model
+
+    def nbytes(self):
+        """
+        Geheugengebruik van alle arrays van het model in bytes.
+        """
+        arrays = [self.tokens, self.context_pos, self.offsets, self.next_ids,
+                  self.counts, self.hash_keys, self.hash_order]
+        if hasattr(self, "cumulative"):
+            arrays.append(self.cumulative)
+        return sum(a.nbytes for a in arrays)
+
+
+def _packed_bits(ngrams):
+    """
+    Aantal bits per token als een n-gram in één uint64 past, anders None.
+    """
+    max_id = int(ngrams.max()) if ngrams.size else 0
+    bits = max(1, max_id.bit_length())
+    return bits if bits * ngrams.shape[1] <= 64 else None
+
+
+def pack_ngrams(ngrams, bits):
+    """
+    Codeer elke rij (n-gram) als één uint64, het eerste token in de hoogste bits.
+    De volgorde van de keys is dan gelijk aan de lexicografische volgorde van de rijen.
+    """
+    keys = np.zeros(len(ngrams), dtype=np.uint64)
+    for c in range(ngrams.shape[1]):
+        keys = (keys << np.uint64(bits)) | ngrams[:, c].astype(np.uint64)
+    return keys
+
+
+def unpack_ngrams(keys, n, bits, dtype=np.uint32):
+    """
+    Omgekeerde van pack_ngrams().
+    """
+    mask = np.uint64((1 << bits) - 1)
+    ngrams = np.empty((len(keys), n), dtype=dtype)
+    for c in range(n):
+        ngrams[:, c] = (keys >> np.uint64(bits * (n - 1 - c))) & mask
+    return ngrams
+
+
+def _reduce_ngrams(ngrams, counts):
+    """
+    Sorteer n-grams lexicografisch en tel dubbele rijen bij elkaar op.
+    Als een n-gram in 64 bits past wordt op één uint64 key gesorteerd, anders met lexsort.
+    """
+    bits = _packed_bits(ngrams)
+    if bits:
+        keys = pack_ngrams(ngrams, bits)
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else order
+        return (unpack_ngrams(keys[starts], ngrams.shape[1], bits, ngrams.dtype),
+                np.add.reduceat(counts[order], starts) if len(starts) else counts[:0])
+
+    order = np.lexsort(ngrams.T[::-1])
+    ngrams = ngrams[order]
+    counts = counts[order]
+    new_row = np.zeros(len(ngrams), dtype=bool)
+    new_row[:1] = True
+    for c in range(ngrams.shape[1]):
+        new_row[1:] |= ngrams[1:, c] != ngrams[:-1, c]
+    starts = np.flatnonzero(new_row)
+    return ngrams[starts], np.add.reduceat(counts, starts) if len(starts) else counts[:0]
+
+
+def count_ngrams(token_ids, n):
+    """
+    Tel alle n-grams in een array met token-ID's, zonder een tuple per positie.
+    Past een n-gram in 64 bits, dan wordt het als één integer geteld met np.unique.
+
+    :return ngrams, counts: 2D array met een uniek n-gram per rij (lexicografisch
+        gesorteerd) en een uint64 count per rij.
+    """
+    token_ids = np.asarray(token_ids)
+    if len(token_ids) < n:
+        return np.zeros((0, n), dtype=token_ids.dtype), np.zeros(0, dtype=np.uint64)
+    windows = np.lib.stride_tricks.sliding_window_view(token_ids, n)
+    bits = _packed_bits(token_ids[:, None])
+    if bits and bits * n <= 64:
+        keys, counts = np.unique(pack_ngrams(windows, bits), return_counts=True)
+        return unpack_ngrams(keys, n, bits, token_ids.dtype), counts.astype(np.uint64)
+    return _reduce_ngrams(windows, np.ones(len(windows), dtype=np.uint64))
+
+
+def merge_ngram_counts(tables):
+    """
+    Voeg count-tabellen van count_ngrams() samen (bijvoorbeeld van verschillende shards).
+    """
+    tables = list(tables)
+    ngrams = np.concatenate([t[0] for t in tables])
+    counts = np.concatenate([t[1] for t in tables])
+    return _reduce_ngrams(ngrams, counts)
+
+
+def count_ngrams_stream(chunks, n):
+    """
+    Tel n-grams over een stroom van token-ID chunks, zonder de hele tekst in het geheugen.
+
+    De laatste n-1 tokens van elke chunk worden meegenomen naar de volgende, zodat
+    n-grams over de grens tussen twee chunks ook geteld worden.
+    """
+    carry = None
+    table = None
+    for chunk in chunks:
+        chunk = np.asarray(chunk)
+        buffer = chunk if carry is None else np.concatenate([carry, chunk])
+        chunk_table = count_ngrams(buffer, n)
+        table = chunk_table if table is None else merge_ngram_counts([table, chunk_table])
+        carry = buffer[max(0, len(buffer) - (n - 1)):] if n > 1 else buffer[:0]
+    if table is None:
+        return np.zeros((0, n), dtype=np.uint16), np.zeros(0, dtype=np.uint64)
+    return table
+
+
+def iter_token_chunks(tok_path, chunk_size=1 << 22, id_to_token=None):
+    """
+    Lees een binair .tok bestand in stukken van chunk_size tokens (views op de memmap).
+
+    :param id_to_token: als opgegeven wordt gecontroleerd of de .tok bij deze vocabulary hoort.
+    """
+    token_ids = load_token_ids(tok_path, id_to_token)
+    for start in range(0, len(token_ids), chunk_size):
+        yield token_ids[start:start + chunk_size]
+
+
+def _count_tok_shard(args):
+    tok_path, n, chunk_size, id_to_token = args
+    return count_ngrams_stream(iter_token_chunks(tok_path, chunk_size, id_to_token), n)
+
+
+def count_ngrams_shards(tok_paths, n, workers=1, chunk_size=1 << 22, id_to_token=None):
+    """
+    Tel n-grams in meerdere binaire .tok shards, elk in een eigen proces, en voeg de
+    tabellen samen. Elke shard is een los stuk tekst: n-grams lopen niet over shards heen.
+
+    :param id_to_token: als opgegeven moet elke shard bij deze vocabulary horen.
+    """
+    jobs = [(path, n, chunk_size, id_to_token) for path in tok_paths]
+    if workers <= 1:
+        tables = [_count_tok_shard(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            tables = list(pool.map(_count_tok_shard, jobs))
+    return merge_ngram_counts(tables)
+
+
+class KneserNeyModel:
+    """
+    Geïnterpoleerd Kneser-Ney n-gram model over de orden 1..n.
+
+    Gebouwd op de counts van een NgramModel per orde. De hoogste orde gebruikt de
+    gewone counts, lagere orden de continuation counts: in hoeveel verschillende
+    contexten een n-gram voorkomt. De laagste orde wordt geïnterpoleerd met een
+    uniforme verdeling, zodat ook onbekende tokens een kans > 0 krijgen.
+    """
+
+    def __init__(self, n=3, discount=0.75):
+        self.n = n
+        self.discount = discount
+
+    def fit(self, token_ids, vocab_size=None):
+        token_ids = np.asarray(token_ids)
+        self.vocab_size = vocab_size or int(token_ids.max()) + 1
+        if token_ids.max() >= self.vocab_size:
+            raise ValueError(f"Token id {int(token_ids.max())} valt buiten vocab_size {self.vocab_size}.")
+        self.models = [NgramModel(k).fit(token_ids) for k in range(1, self.n + 1)]
+        self.entry_keys = [self._entry_keys(model) for model in self.models]
+
+        self.order_counts = [None] * self.n
+        self.order_counts[-1] = self.models[-1].counts.astype(np.float64)
+        for k in range(self.n - 1):
+            self.order_counts[k] = self._continuation_counts(k)
+
+        self.totals = []
+        self.n1plus = []
+        for model, counts in zip(self.models, self.order_counts):
+            starts = model.offsets[:-1]
+            self.totals.append(np.add.reduceat(counts, starts))
+            self.n1plus.append(np.add.reduceat((counts > 0).astype(np.float64), starts))
+        return self
+
+    def _entry_keys(self, model):
+        # Entries staan gesorteerd op (context, volgend token), dus deze sleutel stijgt:
+        entry_context = np.repeat(np.arange(model.n_contexts, dtype=np.uint64),
+                                  np.diff(model.offsets))
+        return entry_context * np.uint64(self.vocab_size) + model.next_ids.astype(np.uint64)
+
+    def _find_entries(self, k, context_indices, next_ids):
+        """
+        Zoek voor (context, token) paren het entry nummer in orde k+1, of -1.
+        """
+        keys = self.entry_keys[k]
+        query = (np.maximum(context_indices, 0).astype(np.uint64) * np.uint64(self.vocab_size)
+                 + np.asarray(next_ids, dtype=np.uint64))
+        entries = np.minimum(np.searchsorted(keys, query), len(keys) - 1)
+        found = (context_indices >= 0) & (keys[entries] == query)
+        return np.where(found, entries, -1)
+
+    def _continuation_counts(self, k):
+        """
+        Continuation counts voor orde k+1: per entry (h, w) het aantal verschillende
+        tokens x waarvoor (x, h, w) in orde k+2 voorkomt.
+        """
+        higher = self.models[k + 1]
+        entry_context = np.repeat(np.arange(higher.n_contexts), np.diff(higher.offsets))
+        pos = higher.context_pos[entry_context]
+        # Context van de lagere orde = context van de hogere orde zonder het eerste token:
+        rows = np.column_stack([higher.tokens[pos + c] for c in range(1, higher.context_size)]
+                               or [np.zeros((len(pos), 0), dtype=higher.tokens.dtype)])
+        lower_contexts = self.models[k].context_indices(rows)
+        entries = self._find_entries(k, lower_contexts, higher.next_ids)
+        return np.bincount(entries[entries >= 0],
+                           minlength=len(self.models[k].next_ids)).astype(np.float64)
+
+    def log_probabilities(self, token_ids):
+        """
+        Log-kansen van elk token vanaf positie n-1, gegeven de n-1 tokens ervoor.
+        Gevectoriseerd over alle posities tegelijk.
+        """
+        token_ids = np.asarray(token_ids)
+        n_scored = len(token_ids) - (self.n - 1)
+        if n_scored <= 0:
+            raise ValueError("Tekst is korter dan n.")
+        if token_ids.max() >= self.vocab_size:
+            # De sleutels ctx * vocab_size + token zouden dan met andere entries botsen:
+            raise ValueError(f"Token id {int(token_ids.max())} valt buiten vocab_size {self.vocab_size}.")
+        targets = token_ids[self.n - 1:]
+        probabilities = np.full(n_scored, 1.0 / self.vocab_size)
+
+        for k, model in enumerate(self.models):
+            start = self.n - 1 - model.context_size
+            rows = np.column_stack([token_ids[start + c:start + c + n_scored]
+                                    for c in range(model.context_size)]
+                                   or [np.zeros((n_scored, 0), dtype=token_ids.dtype)])
+            contexts = model.context_indices(rows)
+            known = contexts >= 0
+            contexts = np.maximum(contexts, 0)
+            total = self.totals[k][contexts]
+            known &= total > 0
+            safe_total = np.where(known, total, 1.0)
+
+            entries = self._find_entries(k, np.where(known, contexts, -1), targets)
+            counts = np.where(entries >= 0, self.order_counts[k][np.maximum(entries, 0)], 0.0)
+            discounted = np.maximum(counts - self.discount, 0.0) / safe_total
+            backoff = self.discount * self.n1plus[k][contexts] / safe_total
+            probabilities = np.where(known, discounted + backoff * probabilities, probabilities)
+        return np.log(probabilities)
+
+    def perplexity(self, token_ids):
+        return float(np.exp(-self.log_probabilities(token_ids).mean()))
+
+
 def save_tokens(path, tokens):
     """
     Sla tokens op in een bestand.
@@ -36,15 +652,79 @@ def save_tokens(path, tokens):
         f.write(" ".join(tokens))
 
 def file_reader(text_path):
+    word_list = []
+    for batch in iter_word_batches(text_path):
+        word_list.extend(batch)
+    return word_list
+
+
+def iter_word_batches(text_path, batch_lines=10000):
+    """
+    Lees een tekst in stukken van batch_lines regels, zonder het hele bestand in het geheugen.
+
+    :param text_path: pad naar het tekstbestand.
+    :param batch_lines: aantal regels per batch.
+    :return: generator met per batch een lijst met woorden zoals file_reader().
+    """
     word_list = []
     with open(text_path) as text:
-        for line in text:
+        for line_nr, line in enumerate(text, 1):
             words_split = line.strip().split()
             for i in words_split:
                 i = list(i.lower())
                 i.append(" ") # Een spatie na elk woord, anders alle text aan elkaar vast...
                 word_list.append(i)
-    return word_list
+            if line_nr % batch_lines == 0:
+                yield word_list
+                word_list = []
+    if word_list:
+        yield word_list
+
+
+def count_words(word_list):
+    """
+    Maak een tabel met unieke woorden en hoe vaak ze voorkomen.
+
+    :param word_list: lijst met woorden (lijsten van tokens), zoals van file_reader().
+    :return words: unieke woorden, op volgorde van eerste voorkomen.
+    :return freqs: hoe vaak elk uniek woord voorkomt.
+    :return word_ids: voor elk woord in word_list de index in words.
+    """
+    index = {}
+    words = []
+    freqs = []
+    word_ids = []
+    for word in word_list:
+        key = tuple(word)
+        if key not in index:
+            index[key] = len(words)
+            words.append(list(word))
+            freqs.append(0)
+        freqs[index[key]] += 1
+        word_ids.append(index[key])
+    return words, freqs, word_ids
+
+
+def read_word_counts(text_path):
+    """
+    Zelfde als count_words(file_reader(text_path)), maar zonder eerst voor
+    elk woord in de tekst een lijst met karakters te maken.
+    """
+    index = {}
+    words = []
+    freqs = []
+    word_ids = []
+    with open(text_path) as text:
+        for line in text:
+            for i in line.strip().split():
+                i = i.lower() + " "
+                if i not in index:
+                    index[i] = len(words)
+                    words.append(list(i))
+                    freqs.append(0)
+                freqs[index[i]] += 1
+                word_ids.append(index[i])
+    return words, freqs, word_ids
 
 
 def get_vocabulary(word_list):
@@ -127,11 +807,459 @@ def byte_pair_encoding(word_list, pair_to_merge):
     return new_word_list
 
 
+
+def word_pairs(word):
+    """
+    Verkrijg alle aangrenzende paren in een woord.
+
+    :param word: lijst met tokens.
+    :return pairs: dict {paar: [aantal, karakter-offset van eerste voorkomen]}
+    """
+    pairs = {}
+    offset = 0
+    for i in range(len(word) - 1):
+        pair = (word[i], word[i+1])
+        if pair in pairs:
+            pairs[pair][0] += 1
+        else:
+            pairs[pair] = [1, offset]
+        offset += len(word[i])
+    return pairs
+
+
+def count_pairs(words, freqs, start=0):
+    """
+    Tel de paren in een (deel van de) woordtabel.
+
+    :param words: lijst met woorden.
+    :param freqs: hoe vaak elk woord voorkomt.
+    :param start: index van het eerste woord in de hele tabel.
+    :return pair_counts, where, first: counts, paar -> woord indices, paar -> eerste voorkomen.
+    """
+    pair_counts = {}
+    where = defaultdict(set)
+    first = {}
+    for w, word in enumerate(words, start):
+        for pair, (n, offset) in word_pairs(word).items():
+            pair_counts[pair] = pair_counts.get(pair, 0) + n * freqs[w - start]
+            where[pair].add(w)
+            if pair not in first:
+                first[pair] = (w, offset)
+    return pair_counts, where, first
+
+
+def _count_pairs_shard(shard):
+    return count_pairs(*shard)
+
+
+def count_pairs_parallel(words, freqs, workers):
+    """
+    Zelfde als count_pairs(), maar verdeeld over workers processen.
+
+    De woordtabel wordt in aaneengesloten stukken gesplitst, zodat het eerste
+    voorkomen van een paar in het eerste stuk waarin het voorkomt ligt.
+    """
+    shard_size = -(-len(words) // (workers * 4)) or 1
+    shards = [(words[i:i + shard_size], freqs[i:i + shard_size], i)
+              for i in range(0, len(words), shard_size)]
+
+    pair_counts = {}
+    where = defaultdict(set)
+    first = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for shard_counts, shard_where, shard_first in pool.map(_count_pairs_shard, shards):
+            for pair, count in shard_counts.items():
+                pair_counts[pair] = pair_counts.get(pair, 0) + count
+                where[pair].update(shard_where[pair])
+                if pair not in first:
+                    first[pair] = shard_first[pair]
+    return pair_counts, where, first
+
+
+class BPETrainer:
+    """
+    Incrementele BPE trainer.
+
+    Houdt een live tabel met paar-counts bij en een index van paar -> woorden
+    waarin het paar voorkomt. Na een merge worden alleen de woorden met dat paar
+    opnieuw geteld, in plaats van de hele tekst zoals tokenizer() doet.
+    Het beste paar wordt gekozen met een heap.
+
+    De merges zijn gelijk aan die van tokenizer() + sort_and_return_token():
+    bij gelijke count wint het paar dat als laatste voor het eerst in de tekst
+    voorkomt. Dat eerste voorkomen wordt bijgehouden als (woord index, offset).
+    """
+
+    def __init__(self, words, freqs=None, workers=1):
+        """
+        :param words: lijst met woorden (lijsten van tokens), op volgorde van de tekst.
+            Liefst unieke woorden uit count_words(), op volgorde van eerste voorkomen.
+        :param freqs: hoe vaak elk woord voorkomt, standaard 1 per woord.
+        :param workers: aantal processen voor het tellen van de paren.
+        """
+        self.words = [list(word) for word in words]
+        self.freqs = list(freqs) if freqs is not None else [1] * len(self.words)
+        self.merges = []
+        self.heap = []
+
+        if workers > 1:
+            self.pair_counts, self.where, self.first = count_pairs_parallel(
+                self.words, self.freqs, workers)
+        else:
+            self.pair_counts, self.where, self.first = count_pairs(self.words, self.freqs)
+
+        for pair in self.pair_counts:
+            self._push(pair)
+
+    def _push(self, pair):
+        w, offset = self.first[pair]
+        heapq.heappush(self.heap, (-self.pair_counts[pair], -w, -offset, pair))
+
+    def best_pair(self):
+        """
+        Geef het paar met de hoogste count en die count terug, of None.
+        """
+        while self.heap:
+            neg_count, neg_w, neg_offset, pair = self.heap[0]
+            if (self.pair_counts.get(pair) == -neg_count
+                    and self.first.get(pair) == (-neg_w, -neg_offset)):
+                return pair, -neg_count
+            # Verouderde entry, er staat een nieuwere in de heap:
+            heapq.heappop(self.heap)
+        return None
+
+    def merge(self, pair_to_merge):
+        """
+        Voeg een paar samen in alle woorden waar het in voorkomt en werk de counts bij.
+        """
+        touched = self.where.get(pair_to_merge, set()).copy()
+        changed = set()
+        new_offsets = defaultdict(dict)
+
+        for w in touched:
+            old_pairs = word_pairs(self.words[w])
+            self.words[w] = byte_pair_encoding([self.words[w]], pair_to_merge)[0]
+            new_pairs = word_pairs(self.words[w])
+            freq = self.freqs[w]
+
+            for pair in old_pairs.keys() | new_pairs.keys():
+                old_n, old_offset = old_pairs.get(pair, (0, None))
+                new_n, new_offset = new_pairs.get(pair, (0, None))
+                if old_n == new_n and old_offset == new_offset:
+                    continue
+                self.pair_counts[pair] = self.pair_counts.get(pair, 0) + (new_n - old_n) * freq
+                if new_n:
+                    self.where[pair].add(w)
+                    new_offsets[pair][w] = new_offset
+                else:
+                    self.where[pair].discard(w)
+                changed.add(pair)
+
+        for pair in changed:
+            if not self.pair_counts[pair]:
+                del self.pair_counts[pair]
+                del self.where[pair]
+                self.first.pop(pair, None)
+                continue
+
+            old_first = self.first.get(pair)
+            candidate = min(((w, offset) for w, offset in new_offsets[pair].items()),
+                            default=None)
+            if old_first is not None and old_first[0] not in touched:
+                first = min(old_first, candidate) if candidate else old_first
+            else:
+                # Het woord met het eerste voorkomen is veranderd, zoek opnieuw:
+                w = min(self.where[pair])
+                if w in new_offsets[pair]:
+                    first = (w, new_offsets[pair][w])
+                else:
+                    first = (w, word_pairs(self.words[w])[pair][1])
+            self.first[pair] = first
+            self._push(pair)
+
+    def train(self, min_freq, max_merges=9999):
+        """
+        Leer merges totdat er geen paar meer min_freq keer voorkomt.
+
+        :param min_freq: minimale frequentie van een paar om samengevoegd te worden.
+        :param max_merges: maximaal aantal merges.
+        :return merges: lijst met samengevoegde paren, in volgorde.
+        """
+        for _ in range(max_merges):
+            best = self.best_pair()
+            if best is None or best[1] < min_freq:
+                break
+            self.merges.append(best[0])
+            self.merge(best[0])
+        return self.merges
+
+    def expand(self, word_ids):
+        """
+        Zet een lijst woord-indices (van count_words()) terug om naar de getokeniseerde tekst.
+        """
+        return [self.words[i] for i in word_ids]
+
             
-def save_encoding(vocab, tokenized_text, enc_path="encoding.enc"):
-    db = {"vocabulary": vocab, "text_tokens": tokenized_text}
-    with open(enc_path, "wb") as f:
-        pickle.dump(db, f)
+def merge_ranks(merges):
+    """
+    Maak een dict {paar: rang} van de geordende merges, rang 0 is de eerste merge.
+    """
+    return {tuple(pair): rank for rank, pair in enumerate(merges)}
+
+
+def encode_word(word, ranks):
+    """
+    Pas de geleerde merges toe op een enkel woord.
+
+    Voegt steeds het paar met de laagste rang samen. Dit geeft hetzelfde resultaat
+    als alle merges op volgorde toepassen met byte_pair_encoding(), maar kost alleen
+    werk voor de paren die echt in het woord voorkomen.
+
+    :param word: lijst met karakters, zoals van file_reader().
+    :param ranks: dict van merge_ranks().
+    :return tokens: lijst met tokens.
+    """
+    tokens = list(word)
+    while len(tokens) > 1:
+        pair = min(zip(tokens, tokens[1:]), key=lambda p: ranks.get(p, len(ranks)))
+        if pair not in ranks:
+            break
+        tokens = byte_pair_encoding([tokens], pair)[0]
+    return tokens
+
+
+class WordEncoder:
+    """
+    Pas geleerde merges toe op woorden, met een LRU-cache per woord.
+
+    Dezelfde woorden komen steeds terug in een tekst, dus het resultaat van
+    encode_word() wordt bewaard met het woord (zoals van file_reader()) als sleutel.
+    """
+
+    def __init__(self, merges, cache_size=100000):
+        """
+        :param merges: geordende lijst met merges.
+        :param cache_size: maximaal aantal woorden in de cache, None is onbeperkt.
+        """
+        self.merges = merges
+        self.ranks = merge_ranks(merges)
+        self._encode_key = functools.lru_cache(maxsize=cache_size)(self._encode_key)
+
+    def _encode_key(self, key):
+        return tuple(encode_word(key, self.ranks))
+
+    def encode(self, word):
+        """
+        Geef de tokens van een woord (lijst met karakters of string).
+        """
+        return list(self._encode_key("".join(word)))
+
+    def encode_words(self, word_list):
+        return [self.encode(word) for word in word_list]
+
+    def encode_ids(self, word, token_to_id):
+        """
+        Geef de token-ID's van een woord, zie tokens_to_ids().
+        """
+        return tokens_to_ids(self._encode_key("".join(word)), token_to_id)
+
+    def cache_info(self):
+        """
+        Hits, misses, maxsize en currsize van de cache.
+        """
+        return self._encode_key.cache_info()
+
+
+# Versie-container voor .enc bestanden, in plaats van een pickle:
+# header (magic, versie, aantal secties), een sectietabel (naam, type, offset, lengte)
+# en daarna de secties zelf. Secties worden pas gelezen als ze nodig zijn.
+ENC_MAGIC = b"BPEENC\x00\x00"
+ENC_VERSION = 1
+ENC_HEADER = struct.Struct("<8sII")
+ENC_SECTION = struct.Struct("<16s4sQQ")
+ENC_DTYPES = {b"u16\x00": np.uint16, b"u32\x00": np.uint32,
+              b"u64\x00": np.uint64, b"i64\x00": np.int64,
+              b"i32\x00": np.int32, b"f64\x00": np.float64}
+
+
+def _id_dtype(n):
+    return np.uint16 if n <= 2**16 else np.uint32
+
+
+def json_section(name, value):
+    return name, b"json", json.dumps(value, ensure_ascii=False).encode("utf-8")
+
+
+def _section_kind(dtype):
+    """
+    Het sectietype (b"u16\x00", ...) van een numpy dtype, zie ENC_DTYPES.
+    """
+    return next(k for k, d in ENC_DTYPES.items() if np.dtype(d) == np.dtype(dtype))
+
+
+def array_section(name, array, dtype=None):
+    array = np.asarray(array, dtype=dtype)
+    return name, _section_kind(array.dtype), array.tobytes()
+
+
+def write_container(path, magic, version, sections):
+    """
+    Schrijf secties (naam, type, bytes) naar een container bestand.
+    Elke sectie begint op een veelvoud van 8 bytes, zodat hij direct gememory-mapt kan worden.
+    """
+    offset = ENC_HEADER.size + ENC_SECTION.size * len(sections)
+    table = []
+    for name, kind, data in sections:
+        offset += -offset % 8
+        table.append(ENC_SECTION.pack(name.encode("ascii"), kind, offset, len(data)))
+        offset += len(data)
+    with open(path, "wb") as f:
+        f.write(ENC_HEADER.pack(magic, version, len(sections)))
+        f.write(b"".join(table))
+        for name, kind, data in sections:
+            f.write(b"\x00" * (-f.tell() % 8))
+            f.write(data)
+
+
+def read_container_table(path, magic, max_version):
+    """
+    Lees de sectietabel van een container: {naam: (type, offset, lengte)}.
+    """
+    with open(path, "rb") as f:
+        file_magic, version, n_sections = ENC_HEADER.unpack(f.read(ENC_HEADER.size))
+        if file_magic != magic:
+            raise ValueError(f"'{path}' heeft niet het verwachte formaat.")
+        if version > max_version:
+            raise ValueError(f"'{path}' heeft versie {version}, "
+                             f"deze code kan tot versie {max_version} lezen.")
+        sections = {}
+        for _ in range(n_sections):
+            name, kind, offset, length = ENC_SECTION.unpack(f.read(ENC_SECTION.size))
+            sections[name.rstrip(b"\x00").decode("ascii")] = (kind, offset, length)
+    return sections
+
+
+def read_section(path, sections, name, mmap=False):
+    """
+    Lees een sectie: JSON wordt geparsed, arrays worden gelezen of (mmap=True) gememory-mapt.
+    """
+    kind, offset, length = sections[name]
+    if kind == b"json":
+        with open(path, "rb") as f:
+            f.seek(offset)
+            return json.loads(f.read(length).decode("utf-8"))
+    dtype = ENC_DTYPES[kind]
+    count = length // np.dtype(dtype).itemsize
+    if mmap and count:
+        return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(count,))
+    return np.fromfile(path, dtype=dtype, count=count, offset=offset)
+
+
+def save_encoding(vocab, tokenized_text, enc_path="encoding.enc", merges=None):
+    """
+    Sla een encoding op in de .enc container.
+
+    Secties:
+    - id_to_token: JSON lijst, index = token-ID
+    - vocabulary: ID's van de tokens in de getokeniseerde trainingstekst
+    - merges: geordende merges als paren van ID's
+    - text_ids, word_lengths: de getokeniseerde tekst als ID's plus het aantal
+      tokens per woord. Wordt overgeslagen als tokenized_text None is.
+    """
+    db = {"vocabulary": vocab, "merges": merges or []}
+    id_to_token = encoding_id_to_token(db)
+    token_to_id = {tok: i for i, tok in enumerate(id_to_token)}
+    id_dtype = _id_dtype(len(id_to_token))
+
+    sections = [
+        json_section("id_to_token", id_to_token),
+        array_section("vocabulary", sorted(token_to_id[tok] for tok in vocab), np.uint32),
+        array_section("merges", [[token_to_id[a], token_to_id[b]] for a, b in db["merges"]],
+                      np.uint32),
+    ]
+    if tokenized_text is not None:
+        text_ids = [token_to_id[tok] for word in tokenized_text for tok in word]
+        sections.append(array_section("text_ids", text_ids, id_dtype))
+        sections.append(array_section("word_lengths", [len(word) for word in tokenized_text],
+                                      np.uint32))
+
+    write_container(enc_path, ENC_MAGIC, ENC_VERSION, sections)
+
+
+class ContainerFile(Mapping):
+    """
+    Read-only dict-achtige toegang tot een container bestand (zie write_container()).
+
+    Subklassen zetten self._keys en implementeren _load(key); elke sleutel wordt pas
+    bij het eerste gebruik geladen en daarna bewaard.
+    """
+
+    def __init__(self, path, magic, max_version):
+        self.path = path
+        self._cache = {}
+        self._keys = []
+        self.sections = read_container_table(path, magic, max_version)
+
+    def _read(self, name, mmap=False):
+        return read_section(self.path, self.sections, name, mmap)
+
+    def _load(self, key):
+        raise KeyError(key)
+
+    def __getitem__(self, key):
+        if key not in self._keys:
+            raise KeyError(key)
+        if key not in self._cache:
+            self._cache[key] = self._load(key)
+        return self._cache[key]
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class EncodingFile(ContainerFile):
+    """
+    Read-only dict-achtige toegang tot een .enc container.
+
+    Geeft dezelfde sleutels als de oude pickle ("vocabulary" als set, "text_tokens"
+    als lijst met woorden, "merges"), plus "id_to_token" en "text_ids". Elke sectie
+    wordt pas bij het eerste gebruik van schijf gelezen.
+    """
+
+    def __init__(self, enc_path):
+        super().__init__(enc_path, ENC_MAGIC, ENC_VERSION)
+        self._keys = ["vocabulary", "merges", "id_to_token"]
+        if "text_ids" in self.sections:
+            self._keys += ["text_tokens", "text_ids"]
+
+    def _load(self, key):
+        if key == "id_to_token":
+            return self._read("id_to_token")
+        if key == "vocabulary":
+            id_to_token = self["id_to_token"]
+            return {id_to_token[i] for i in self._read("vocabulary")}
+        if key == "merges":
+            id_to_token = self["id_to_token"]
+            return [(id_to_token[a], id_to_token[b])
+                    for a, b in self._read("merges").reshape(-1, 2).tolist()]
+        if key == "text_ids":
+            return self._read("text_ids")
+        if key == "text_tokens":
+            id_to_token = self["id_to_token"]
+            tokens = [id_to_token[i] for i in self["text_ids"].tolist()]
+            text_tokens = []
+            start = 0
+            for length in self._read("word_lengths").tolist():
+                text_tokens.append(tokens[start:start + length])
+                start += length
+            return text_tokens
+        raise KeyError(key)
 
 
 # def save_to_file(vocabulary, text_tokens):
@@ -153,15 +1281,193 @@ def save_encoding(vocab, tokenized_text, enc_path="encoding.enc"):
 #     pickle.dumps(vocabulary)
     
 def load_encoding(enc_path):
-    """Laad pickle met vocab en"""
+    """
+    Laad een .enc bestand. Oude pickle bestanden worden nog gelezen,
+    maar alleen van bronnen die je vertrouwt: pickle kan code uitvoeren.
+    """
     with open(enc_path, "rb") as f:
-        return pickle.load(f)
+        if f.read(len(ENC_MAGIC)) == ENC_MAGIC:
+            return EncodingFile(enc_path)
+        f.seek(0)
+        try:
+            db = pickle.load(f)
+        except (pickle.UnpicklingError, EOFError) as e:
+            raise ValueError(f"'{enc_path}' is geen .enc container en geen pickle ({e}).") from None
+
+    # De oudste .enc bestanden (zoals notebooks/cancer_tokens.enc) zijn een platte
+    # lijst tokens, zonder vocabulary of merges: elk token wordt een eigen woord.
+    if isinstance(db, list):
+        return {"vocabulary": set(db), "text_tokens": [[token] for token in db]}
+    if not isinstance(db, dict) or "vocabulary" not in db:
+        raise ValueError(f"'{enc_path}' heeft een onbekend pickle formaat ({type(db).__name__}).")
+    return db
 
 
 def flatten_token_lists(token_lists):
     "Van list of lists naar list"
     return [token for word in token_lists for token in word]
 
+
+def encoding_token_ids(enc_db):
+    """
+    De getokeniseerde trainingstekst van een encoding als array met token-ID's.
+    """
+    if "text_ids" in enc_db:
+        return np.asarray(enc_db["text_ids"])
+    token_to_id = {tok: i for i, tok in enumerate(encoding_id_to_token(enc_db))}
+    return np.array([token_to_id[t] for t in flatten_token_lists(enc_db["text_tokens"])])
+
+
+# Binair .tok formaat: een header van TOK_HEADER_SIZE bytes, daarna de token-ID's
+# als uint16 (of uint32 bij een vocabulary van meer dan 65536 tokens).
+TOK_MAGIC = b"BPETOK\x00\x01"
+TOK_HEADER = struct.Struct("<8sIIQ32s")
+TOK_HEADER_SIZE = 64
+
+
+def encoding_id_to_token(enc_db):
+    """
+    Verkrijg de vaste lijst id -> token van een encoding.
+
+    Bevat de vocabulary plus alle tokens uit de merges, want tokens die in de
+    trainingstekst helemaal door latere merges zijn opgegeten kunnen bij het
+    encoderen van een andere tekst wel overblijven.
+    """
+    if "id_to_token" in enc_db:
+        return enc_db["id_to_token"]
+
+    tokens = set(enc_db["vocabulary"])
+    for a, b in enc_db.get("merges") or []:
+        tokens.update((a, b, a + b))
+    return sorted(tokens)
+
+
+def vocab_fingerprint(id_to_token):
+    """
+    SHA-256 van de id -> token lijst, zodat een .tok bij de juiste encoding gebruikt wordt.
+    """
+    return hashlib.sha256("\x00".join(id_to_token).encode("utf-8")).digest()
+
+
+def tokens_to_ids(tokens, token_to_id, unknown=None):
+    """
+    Zet tokens om naar ID's. Onbekende tokens worden opgesplitst in karakters,
+    onbekende karakters worden overgeslagen (zelfde als BPETokenizer.encode).
+
+    :param unknown: optioneel een Counter waarin de overgeslagen karakters geteld
+        worden, zodat de aanroeper kan melden dat er tekst verloren gaat.
+    """
+    ids = []
+    for tok in tokens:
+        if tok in token_to_id:
+            ids.append(token_to_id[tok])
+        else:
+            for ch in tok:
+                if ch in token_to_id:
+                    ids.append(token_to_id[ch])
+                elif unknown is not None:
+                    unknown[ch] += 1
+    return ids
+
+
+class TokWriter:
+    """
+    Schrijf token-ID's in stukken naar een binair .tok bestand.
+
+    Het aantal tokens in de header wordt bij close() ingevuld, zodat de ID's
+    tijdens het encoderen direct weggeschreven kunnen worden.
+    """
+
+    def __init__(self, tok_path, id_to_token):
+        self.vocab_size = len(id_to_token)
+        self.dtype = _id_dtype(self.vocab_size)
+        self.fingerprint = vocab_fingerprint(id_to_token)
+        self.n_tokens = 0
+        self.file = open(tok_path, "wb")
+        self.file.write(b"\x00" * TOK_HEADER_SIZE)
+
+    def write(self, token_ids):
+        self.file.write(np.asarray(token_ids, dtype=self.dtype).tobytes())
+        self.n_tokens += len(token_ids)
+
+    def close(self):
+        header = TOK_HEADER.pack(TOK_MAGIC, np.dtype(self.dtype).itemsize,
+                                 self.vocab_size, self.n_tokens, self.fingerprint)
+        self.file.seek(0)
+        self.file.write(header.ljust(TOK_HEADER_SIZE, b"\x00"))
+        self.file.close()
+
+    def abort(self):
+        """
+        Stop zonder header: het halve bestand wordt verwijderd, zodat er geen
+        .tok achterblijft die er geldig uitziet.
+        """
+        self.file.close()
+        os.remove(self.file.name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+
+def save_token_ids(tok_path, token_ids, id_to_token):
+    """
+    Sla een lijst of array met token-ID's op als binair .tok bestand.
+    """
+    with TokWriter(tok_path, id_to_token) as writer:
+        writer.write(token_ids)
+
+
+def is_token_id_file(tok_path):
+    with open(tok_path, "rb") as f:
+        return f.read(len(TOK_MAGIC)) == TOK_MAGIC
+
+
+def decode_token_ids(token_ids, id_to_bytes, chunk_size=1 << 20):
+    """
+    Zet token-ID's in één keer om naar tekst met een id -> bytes tabel.
+
+    :param token_ids: array of lijst met token-ID's.
+    :param id_to_bytes: numpy object-array met per ID het token als utf-8 bytes.
+    :param chunk_size: aantal tokens per stuk.
+    :return: generator met stukken utf-8 bytes.
+    """
+    token_ids = np.asarray(token_ids)
+    for start in range(0, len(token_ids), chunk_size):
+        yield b"".join(id_to_bytes[token_ids[start:start + chunk_size]])
+
+
+def id_to_bytes_table(id_to_token):
+    return np.array([tok.encode("utf-8") for tok in id_to_token], dtype=object)
+
+
+def load_token_ids(tok_path, id_to_token=None):
+    """
+    Open een binair .tok bestand als numpy.memmap, zonder het te kopiëren.
+
+    :param tok_path: pad naar het .tok bestand.
+    :param id_to_token: als opgegeven wordt gecontroleerd of de .tok bij deze vocabulary hoort.
+    :return token_ids: read-only array met token-ID's.
+    """
+    with open(tok_path, "rb") as f:
+        magic, itemsize, vocab_size, n_tokens, fingerprint = TOK_HEADER.unpack(
+            f.read(TOK_HEADER_SIZE)[:TOK_HEADER.size])
+    if magic != TOK_MAGIC:
+        raise ValueError(f"'{tok_path}' is geen binair .tok bestand.")
+    if id_to_token is not None and fingerprint != vocab_fingerprint(id_to_token):
+        raise ValueError(f"'{tok_path}' hoort niet bij deze encoding.")
+
+    dtype = np.dtype(f"u{itemsize}")
+    if n_tokens == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(tok_path, dtype=dtype, mode="r",
+                     offset=TOK_HEADER_SIZE, shape=(n_tokens,))
+
 # def train_ngram_model(token_list, n=3):
 #     transitions = defaultdict(Counter)
 #     context = n - 1
@@ -177,6 +1483,554 @@ def flatten_token_lists(token_lists):
 #     return model
 
 
+def iter_batches(items, batch_size):
+    """
+    Groepeer een iterable in lijsten van batch_size elementen (de laatste kan korter zijn).
+    """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_documents(paths):
+    """
+    Lees documenten (een per regel) lazy uit een of meer tekstbestanden.
+    """
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            yield from f
+
+
+def document_words(document, word_suffix=" "):
+    """
+    Splits een document in woorden zoals file_reader(): lowercase, met word_suffix erachter.
+    """
+    return [word.lower() + word_suffix for word in document.split()]
+
+
+def _encode_document_list(documents, encoder, token_to_id, dtype, word_suffix):
+    encoded = []
+    for document in documents:
+        ids = []
+        for word in document_words(document, word_suffix):
+            ids.extend(encoder.encode_ids(word, token_to_id))
+        encoded.append(np.array(ids, dtype=dtype))
+    return encoded
+
+
+_batch_worker = {}
+
+
+def _init_batch_worker(merges, id_to_token, cache_size, word_suffix):
+    _batch_worker["encoder"] = WordEncoder(merges, cache_size)
+    _batch_worker["token_to_id"] = {tok: i for i, tok in enumerate(id_to_token)}
+    _batch_worker["dtype"] = _id_dtype(len(id_to_token))
+    _batch_worker["word_suffix"] = word_suffix
+
+
+def _encode_batch_in_worker(documents):
+    return _encode_document_list(documents, _batch_worker["encoder"], _batch_worker["token_to_id"],
+                                 _batch_worker["dtype"], _batch_worker["word_suffix"])
+
+
+def encode_documents(documents, merges, id_to_token, cache_size=100000,
+                     workers=1, batch_size=1000, word_suffix=" "):
+    """
+    Encodeer veel documenten in één keer naar arrays met token-ID's.
+
+    Alle documenten delen dezelfde merge-rang tabel en woord-cache (per proces,
+    als workers > 1 worden de documenten in batches over een process pool verdeeld).
+
+    :param documents: iterable met documenten (strings).
+    :param merges: geordende lijst met merges.
+    :param id_to_token: lijst id -> token, zie encoding_id_to_token().
+    :param cache_size: grootte van de woord-cache.
+    :param workers: aantal processen.
+    :param batch_size: aantal documenten per taak voor een worker.
+    :param word_suffix: wordt achter elk woord gezet, " " zoals file_reader().
+    :return: lijst met een uint16/uint32 array per document, in dezelfde volgorde.
+    """
+    if workers <= 1:
+        encoder = WordEncoder(merges, cache_size)
+        token_to_id = {tok: i for i, tok in enumerate(id_to_token)}
+        return _encode_document_list(documents, encoder, token_to_id,
+                                     _id_dtype(len(id_to_token)), word_suffix)
+
+    encoded = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker,
+                             initargs=(merges, id_to_token, cache_size, word_suffix)) as pool:
+        for result in pool.map(_encode_batch_in_worker, iter_batches(documents, batch_size)):
+            encoded.extend(result)
+    return encoded
+
+
+def document_term_matrix(documents, n_features):
+    """
+    Bouw in één pass een scipy.sparse CSR document-term matrix met counts.
+
+    :param documents: iterable met per document een reeks token-ID's
+        (bijvoorbeeld de arrays van encode_documents()).
+    :param n_features: aantal kolommen (grootte van de vocabulary).
+    :return CSR matrix (int32), een rij per document.
+    """
+    from scipy import sparse
+
+    indptr = [0]
+    chunks = []
+    for document in documents:
+        ids = np.asarray(document, dtype=np.int64)
+        chunks.append(ids)
+        indptr.append(indptr[-1] + len(ids))
+    indices = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int64)
+
+    x = sparse.csr_matrix((np.ones(len(indices), dtype=np.int32), indices, np.array(indptr)),
+                          shape=(len(indptr) - 1, n_features))
+    x.sum_duplicates()
+    return x
+
+
+def multi_hot_matrix(counts):
+    """
+    Multi-hot versie van een count matrix: elke count > 0 wordt 1.
+    """
+    x = counts.copy()
+    x.data[:] = 1
+    return x
+
+
+def document_frequencies(counts):
+    """
+    In hoeveel documenten (rijen) komt elk token voor.
+    """
+    return np.bincount(counts.indices, minlength=counts.shape[1])
+
+
+def idf_weights(df, n_documents):
+    """
+    Gladgestreken IDF, zelfde formule als compute_idf() in bagofwords.py.
+    """
+    return np.log((n_documents + 1) / (np.asarray(df) + 1)) + 1
+
+
+def tfidf_matrix(counts, idf=None, decimals=3):
+    """
+    TF-IDF matrix zoals tf_idf_vector() in bagofwords.py: multi-hot maal IDF, afgerond.
+
+    :param idf: IDF gewichten, standaard berekend uit counts zelf.
+    """
+    if idf is None:
+        idf = idf_weights(document_frequencies(counts), counts.shape[0])
+    x = counts.astype(np.float64)
+    x.data = np.round(idf[x.indices], decimals)
+    # Afronden kan een gewicht 0 maken; die horen niet in een sparse matrix:
+    x.eliminate_zeros()
+    return x
+
+
+BOW_MAGIC = b"BOWCSR\x00\x00"
+BOW_VERSION = 1
+
+
+class BowWriter:
+    """
+    Schrijf een document-term matrix in batches van rijen naar een binaire .bow,
+    zonder de hele matrix in het geheugen (zie save_bow() voor de secties).
+
+    De indices gaan direct naar het bestand, de data naar een tijdelijk bestand dat
+    bij close() erachter wordt gekopieerd. Daarna worden indptr, de JSON secties en
+    de sectietabel geschreven.
+    """
+
+    def __init__(self, bow_path, vocabulary, encoding="count", idf=None, data_dtype=np.int32,
+                 n_columns=None):
+        """
+        :param n_columns: aantal kolommen, standaard len(vocabulary). Nodig als er geen
+            vocabulary is, zoals bij de hashing trick.
+        """
+        self.vocabulary = list(vocabulary)
+        self.n_columns = len(self.vocabulary) if n_columns is None else n_columns
+        self.encoding = encoding
+        self.idf = idf
+        self.data_dtype = data_dtype
+        self.n_rows = 0
+        self.nnz = 0
+        self.indptr = [np.zeros(1, dtype=np.int64)]
+
+        self.n_sections = 6 if idf is not None else 5
+        self.file = open(bow_path, "wb")
+        table_size = ENC_HEADER.size + ENC_SECTION.size * self.n_sections
+        self.file.write(b"\x00" * (table_size + -table_size % 8))
+        self.indices_offset = self.file.tell()
+        self.data_file = tempfile.TemporaryFile()
+
+    def write(self, matrix):
+        """
+        Voeg de rijen van een sparse matrix toe.
+        """
+        matrix = matrix.tocsr()
+        self.file.write(np.asarray(matrix.indices, dtype=np.int32).tobytes())
+        self.data_file.write(np.asarray(matrix.data, dtype=self.data_dtype).tobytes())
+        self.indptr.append(matrix.indptr[1:].astype(np.int64) + self.nnz)
+        self.n_rows += matrix.shape[0]
+        self.nnz += matrix.nnz
+
+    def close(self):
+        table = [("indices", b"i32\x00", self.indices_offset, self.nnz * 4)]
+
+        self.file.write(b"\x00" * (-self.file.tell() % 8))
+        data_offset = self.file.tell()
+        self.data_file.seek(0)
+        shutil.copyfileobj(self.data_file, self.file)
+        self.data_file.close()
+        table.append(("data", _section_kind(self.data_dtype), data_offset,
+                      self.file.tell() - data_offset))
+
+        sections = [
+            array_section("indptr", np.concatenate(self.indptr)),
+            json_section("meta", {"shape": [self.n_rows, self.n_columns],
+                                  "encoding": self.encoding}),
+            json_section("vocabulary", self.vocabulary),
+        ]
+        if self.idf is not None:
+            sections.append(array_section("idf", self.idf, np.float64))
+        for name, kind, data in sections:
+            self.file.write(b"\x00" * (-self.file.tell() % 8))
+            table.append((name, kind, self.file.tell(), len(data)))
+            self.file.write(data)
+
+        self.file.seek(0)
+        self.file.write(ENC_HEADER.pack(BOW_MAGIC, BOW_VERSION, len(table)))
+        for name, kind, offset, length in table:
+            self.file.write(ENC_SECTION.pack(name.encode("ascii"), kind, offset, length))
+        self.file.close()
+
+    def abort(self):
+        """
+        Stop zonder af te ronden: het halve bestand wordt verwijderd, zodat er geen
+        .bow achterblijft die er geldig uitziet.
+        """
+        self.data_file.close()
+        self.file.close()
+        os.remove(self.file.name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+
+def save_bow(bow_path, matrix, vocabulary, encoding="count", idf=None):
+    """
+    Sla een document-term matrix op als binaire .bow container.
+
+    Secties:
+    - meta: JSON met shape en encoding (count, multi-hot, tfidf, ...)
+    - vocabulary: JSON lijst, index = kolom (leeg bij de hashing trick)
+    - indptr, indices, data: de CSR arrays
+    - idf: IDF per kolom, alleen als die meegegeven is
+
+    :param matrix: scipy.sparse matrix, een rij per document.
+    :param vocabulary: tokens op volgorde van de kolommen.
+    """
+    data_dtype = np.float64 if matrix.dtype.kind == "f" else np.int32
+    with BowWriter(bow_path, vocabulary, encoding, idf, data_dtype, matrix.shape[1]) as writer:
+        writer.write(matrix)
+
+
+class BowFile(ContainerFile):
+    """
+    Read-only dict-achtige toegang tot een .bow container, zoals EncodingFile.
+
+    Sleutels: "matrix" (CSR matrix op gememory-mapte arrays, dus rijen worden pas
+    gelezen als ze gebruikt worden), "vocabulary", "encoding" en eventueel "idf".
+    """
+
+    def __init__(self, bow_path):
+        super().__init__(bow_path, BOW_MAGIC, BOW_VERSION)
+        self._keys = ["matrix", "vocabulary", "encoding"]
+        if "idf" in self.sections:
+            self._keys.append("idf")
+
+    def _load(self, key):
+        if key == "matrix":
+            from scipy import sparse
+
+            shape = tuple(self._read("meta")["shape"])
+            return sparse.csr_matrix((self._read("data", mmap=True), self._read("indices", mmap=True),
+                                      self._read("indptr")), shape=shape)
+        if key == "encoding":
+            return self._read("meta")["encoding"]
+        return self._read(key)
+
+
+def load_bow(bow_path):
+    """
+    Open een binaire .bow, zie save_bow() en BowFile.
+    """
+    return BowFile(bow_path)
+
+
+def learn_merges(documents, min_freq=2):
+    """
+    Leer BPE merges op documenten zoals bagofwords.py ze leest (woorden zonder spatie).
+    Alleen de unieke woorden met hun counts worden bewaard, dus documents mag een
+    lazy iterator zijn.
+
+    :return merges, vocabulary: de merges en de gesorteerde tokens: alle karakters van
+        de trainingstekst plus elk merge-resultaat, zoals encoding_id_to_token().
+    """
+    word_counts = {}
+    for document in documents:
+        for word in document_words(document, ""):
+            word_counts[word] = word_counts.get(word, 0) + 1
+    characters = {char for word in word_counts for char in word}
+    trainer = BPETrainer(list(word_counts), list(word_counts.values()))
+    merges = trainer.train(min_freq)
+    vocabulary = encoding_id_to_token({"vocabulary": characters, "merges": merges})
+    return merges, vocabulary
+
+
+BOWVEC_MAGIC = b"BOWVEC\x00\x00"
+BOWVEC_VERSION = 1
+BOW_ENCODINGS = ["count", "multi-hot", "tfidf"]
+
+
+class BagOfWordsVectorizer:
+    """
+    Bag of words met een vaste BPE encoding, vocabulary en IDF.
+
+    fit() leert de merges, een stabiele token -> kolom tabel (gesorteerd, dus
+    onafhankelijk van de volgorde van een set) en de IDF gewichten. Daarna kan
+    transform() nieuwe documenten vectoriseren tegen hetzelfde model, en zijn
+    vectoren van verschillende runs vergelijkbaar.
+    """
+
+    def __init__(self, encoding="count", min_freq=2, cache_size=100000):
+        """
+        :param encoding: "count", "multi-hot" of "tfidf".
+        :param min_freq: minimale frequentie van een paar voor een BPE merge.
+        """
+        if encoding not in BOW_ENCODINGS:
+            raise ValueError(f"Onbekende encoding '{encoding}', kies uit {BOW_ENCODINGS}.")
+        self.encoding = encoding
+        self.min_freq = min_freq
+        self.cache_size = cache_size
+        self.merges = []
+        self.vocabulary = []
+        self.idf = None
+        self._encoder = None
+        self._token_to_index = None
+
+    @property
+    def n_features(self):
+        return len(self.vocabulary)
+
+    @property
+    def token_to_index(self):
+        return {token: i for i, token in enumerate(self.vocabulary)}
+
+    def _encode(self, documents):
+        """
+        Documenten (strings) naar arrays met kolom-indices, zoals pre_process() + apply_bpe()
+        in bagofwords.py. De WordEncoder en zijn cache worden tussen aanroepen hergebruikt.
+        """
+        if self._encoder is None:
+            self._encoder = WordEncoder(self.merges, self.cache_size)
+            self._token_to_index = self.token_to_index
+        return _encode_document_list(documents, self._encoder, self._token_to_index,
+                                     np.int64, "")
+
+    def counts(self, documents):
+        """
+        CSR count matrix van documenten tegen de vaste vocabulary.
+        """
+        return document_term_matrix(self._encode(documents), self.n_features)
+
+    def _fit_merges(self, documents):
+        self.merges, self.vocabulary = learn_merges(documents, self.min_freq)
+        self._encoder = None
+
+    def fit(self, documents):
+        """
+        Leer merges, vocabulary en IDF op een lijst documenten (strings).
+        """
+        documents = list(documents)
+        self._fit_merges(documents)
+        counts = self.counts(documents)
+        self.idf = idf_weights(document_frequencies(counts), counts.shape[0])
+        return self
+
+    def fit_idf_stream(self, documents, batch_size=10000):
+        """
+        Bereken de IDF in batches, met de merges en vocabulary die er al zijn.
+        """
+        df = np.zeros(len(self.vocabulary), dtype=np.int64)
+        n_documents = 0
+        for batch in iter_batches(documents, batch_size):
+            counts = self.counts(batch)
+            df += document_frequencies(counts)
+            n_documents += counts.shape[0]
+        self.idf = idf_weights(df, n_documents)
+        return self
+
+    def fit_stream(self, make_documents, batch_size=10000):
+        """
+        Zelfde als fit(), maar zonder alle documenten in het geheugen: eerst een pass
+        voor de woord-counts (BPE), dan een pass in batches voor de document-frequenties.
+
+        :param make_documents: functie die telkens een nieuwe iterator over de
+            documenten geeft, bijvoorbeeld lambda: iter_documents(paths).
+        """
+        self._fit_merges(make_documents())
+        return self.fit_idf_stream(make_documents(), batch_size)
+
+    def transform_stream(self, documents, writer, batch_size=10000, encoding=None):
+        """
+        Vectoriseer documenten in batches en schrijf elke batch direct naar een BowWriter.
+        """
+        for batch in iter_batches(documents, batch_size):
+            writer.write(self.transform(batch, encoding))
+        return writer
+
+    def transform(self, documents, encoding=None):
+        """
+        Vectoriseer documenten met het vaste model.
+
+        :param encoding: standaard de encoding van de vectorizer.
+        :return CSR matrix, een rij per document.
+        """
+        encoding = encoding or self.encoding
+        counts = self.counts(documents)
+        if encoding == "multi-hot":
+            return multi_hot_matrix(counts)
+        if encoding == "tfidf":
+            return tfidf_matrix(counts, self.idf)
+        return counts
+
+    def fit_transform(self, documents):
+        documents = list(documents)
+        return self.fit(documents).transform(documents)
+
+    def save(self, path):
+        """
+        Sla merges, vocabulary en IDF op in een container bestand.
+        """
+        write_container(path, BOWVEC_MAGIC, BOWVEC_VERSION, [
+            json_section("meta", {"encoding": self.encoding, "min_freq": self.min_freq}),
+            json_section("merges", self.merges),
+            json_section("vocabulary", self.vocabulary),
+            array_section("idf", self.idf, np.float64),
+        ])
+
+    @classmethod
+    def load(cls, path, cache_size=100000):
+        sections = read_container_table(path, BOWVEC_MAGIC, BOWVEC_VERSION)
+        meta = read_section(path, sections, "meta")
+        if meta["encoding"] == "hashed":
+            raise ValueError(f"'{path}' is een HashingVectorizer, laad het met HashingVectorizer.load().")
+        vectorizer = cls(meta["encoding"], meta["min_freq"], cache_size)
+        vectorizer.merges = [tuple(pair) for pair in read_section(path, sections, "merges")]
+        vectorizer.vocabulary = read_section(path, sections, "vocabulary")
+        vectorizer.idf = read_section(path, sections, "idf")
+        return vectorizer
+
+
+def fnv1a_64(data):
+    """
+    64-bit FNV-1a hash van bytes; stabiel tussen runs, in tegenstelling tot hash().
+    """
+    h = int(FNV_OFFSET)
+    for byte in data:
+        h = ((h ^ byte) * int(FNV_PRIME)) & 0xFFFFFFFFFFFFFFFF
+    return h
+
+
+class HashingVectorizer:
+    """
+    Bag of words met de hashing trick: elk BPE token (en eventueel elk n-gram van
+    tokens) gaat met een stabiele hash naar een van n_features kolommen.
+
+    Er is geen vocabulary of IDF nodig, alleen de merges, dus nieuwe documenten
+    kunnen direct gevectoriseerd worden en de kolommen liggen vast. Tokens met
+    dezelfde bucket worden samen geteld.
+    """
+
+    def __init__(self, merges, n_features=2**20, ngram=1, cache_size=100000):
+        """
+        :param merges: geordende lijst met merges, bijvoorbeeld van learn_merges().
+        :param n_features: aantal buckets (kolommen).
+        :param ngram: hoogste orde van token n-grams; 1 is alleen losse tokens.
+        """
+        self.merges = merges
+        self.n_features = n_features
+        self.ngram = ngram
+        self.vocabulary = []
+        self.idf = None
+        self.encoder = WordEncoder(merges, cache_size)
+        self._word_hashes = functools.lru_cache(maxsize=cache_size)(self._word_hashes)
+
+    def save(self, path):
+        """
+        Sla de merges en de hash instellingen op, in dezelfde container als
+        BagOfWordsVectorizer.save() (zonder vocabulary en IDF).
+        """
+        write_container(path, BOWVEC_MAGIC, BOWVEC_VERSION, [
+            json_section("meta", {"encoding": "hashed", "n_features": self.n_features,
+                                  "ngram": self.ngram}),
+            json_section("merges", self.merges),
+        ])
+
+    @classmethod
+    def load(cls, path, n_features=2**20, ngram=1, cache_size=100000):
+        """
+        Laad de merges uit een opgeslagen HashingVectorizer of BagOfWordsVectorizer.
+        Bij een hashed model gaan de opgeslagen n_features en ngram voor, zodat de
+        kolommen gelijk blijven aan die van eerdere runs.
+        """
+        sections = read_container_table(path, BOWVEC_MAGIC, BOWVEC_VERSION)
+        meta = read_section(path, sections, "meta")
+        merges = [tuple(pair) for pair in read_section(path, sections, "merges")]
+        return cls(merges, meta.get("n_features", n_features), meta.get("ngram", ngram), cache_size)
+
+    def _word_hashes(self, word):
+        return [fnv1a_64(token.encode("utf-8")) for token in self.encoder.encode(word)]
+
+    def _features(self, document):
+        hashes = []
+        for word in document_words(document, ""):
+            hashes.extend(self._word_hashes(word))
+        hashes = np.array(hashes, dtype=np.uint64)
+        features = [hashes]
+        for n in range(2, self.ngram + 1):
+            if len(hashes) >= n:
+                features.append(hash_contexts([hashes[c:len(hashes) - n + 1 + c] for c in range(n)]))
+        return np.concatenate(features) % np.uint64(self.n_features)
+
+    def transform(self, documents, encoding=None):
+        """
+        :return CSR count matrix met een rij per document en n_features kolommen.
+        """
+        return document_term_matrix((self._features(document) for document in documents),
+                                    self.n_features)
+
+    def transform_stream(self, documents, writer, batch_size=10000, encoding=None):
+        """
+        Zelfde als BagOfWordsVectorizer.transform_stream().
+        """
+        for batch in iter_batches(documents, batch_size):
+            writer.write(self.transform(batch))
+        return writer
+
+
 def make_cbow_examples_ids(token_ids, window):
     """
     Bouw CBOW-training op basis van een lijst token-ID's (ints).
@@ -206,10 +2060,43 @@ def make_cbow_examples_ids(token_ids, window):
     y = np.array(y, dtype=np.int64)
     return x, y, vocab_size
 
+def make_cbow_examples_sparse(token_ids, window, vocab_size=None):
+    """
+    Zelfde CBOW-dataset als make_cbow_examples_ids(), maar x is een scipy.sparse CSR
+    matrix: per positie worden alleen de 2*window context-ID's opgeslagen in plaats
+    van een dichte vector van vocab_size.
+
+    :param token_ids: lijst of numpy array met token-ID's.
+    :return x (CSR, float32), y (int64), vocab_size
+    """
+    from scipy import sparse
+
+    token_ids = np.asarray(token_ids, dtype=np.int64)
+    if not len(token_ids):
+        raise ValueError("Lege tokenlijst.")
+    if vocab_size is None:
+        vocab_size = int(token_ids.max()) + 1
+
+    windows = np.lib.stride_tricks.sliding_window_view(token_ids, 2 * window + 1)
+    y = windows[:, window].copy()
+    context = np.delete(windows, window, axis=1)
+
+    width = context.shape[1]
+    indptr = np.arange(0, len(context) * width + 1, width, dtype=np.int64)
+    x = sparse.csr_matrix((np.ones(context.size, dtype=np.float32), context.ravel(), indptr),
+                          shape=(len(context), vocab_size))
+    # Multi-hot, geen counts: een token dat twee keer in de context staat blijft 1.
+    x.sum_duplicates()
+    x.data[:] = 1.0
+    return x, y, vocab_size
+
 def train_cbow_mlp(x, y, hidden_dim):
     """
     Train een simpele MLP met één verborgen laag.
     """
+    # Pas hier importeren: sklearn laden kost meer dan een seconde opstarttijd.
+    from sklearn.neural_network import MLPClassifier
+
     clf = MLPClassifier(
         hidden_layer_sizes=(hidden_dim,),
         activation="tanh",
@@ -239,6 +2126,208 @@ def extract_embeddings_from_mlp_ids(clf):
     return id_to_vec
 
 
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-np.clip(x, -30, 30)))
+
+
+class EmbeddingTrainer:
+    """
+    CBOW of skip-gram met negative sampling, direct in NumPy op token-ID arrays.
+
+    In plaats van een softmax over alle tokens (zoals de MLP) wordt per voorbeeld
+    het echte token tegen `negative` willekeurige tokens gescoord, dus de kosten
+    hangen niet af van de grootte van de vocabulary. Updates gaan per mini-batch
+    van posities. Veel voorkomende tokens worden eerst weggefilterd (subsampling).
+    """
+
+    def __init__(self, vocab_size, dim=100, window=2, mode="cbow", negative=5,
+                 subsample=1e-3, learning_rate=None, batch_size=512, seed=None):
+        """
+        :param mode: "cbow" (context -> token) of "skipgram" (token -> context).
+        :param subsample: drempel t van word2vec; een token met frequentie f wordt
+            bewaard met kans (sqrt(f / t) + 1) * t / f. 0 zet subsampling uit.
+        :param learning_rate: start learning rate, standaard 0.05 voor cbow en
+            0.025 voor skipgram (zoals word2vec).
+        """
+        if mode not in ("cbow", "skipgram"):
+            raise ValueError(f"Onbekende mode '{mode}', kies cbow of skipgram.")
+        self.vocab_size = vocab_size
+        self.dim = dim
+        self.window = window
+        self.mode = mode
+        self.negative = negative
+        self.subsample = subsample
+        self.learning_rate = learning_rate or (0.05 if mode == "cbow" else 0.025)
+        self.batch_size = batch_size
+        self.rng = np.random.default_rng(seed)
+
+        self.w_in = ((self.rng.random((vocab_size, dim), dtype=np.float32) - 0.5) / dim)
+        self.w_out = np.zeros((vocab_size, dim), dtype=np.float32)
+        self.counts = np.zeros(vocab_size, dtype=np.int64)
+        self.tokens_per_second = 0.0
+
+    def _prepare(self, token_ids):
+        """
+        Tel de tokens en bouw de verdeling voor negative sampling (counts ** 0.75).
+        """
+        self.counts = np.bincount(token_ids, minlength=self.vocab_size)
+        noise = self.counts.astype(np.float64) ** 0.75
+        self.noise_cumulative = np.cumsum(noise / noise.sum())
+
+    def _subsample(self, token_ids, rng):
+        if not self.subsample:
+            return token_ids
+        freq = self.counts[token_ids] / self.counts.sum()
+        keep_prob = (np.sqrt(freq / self.subsample) + 1) * self.subsample / freq
+        return token_ids[rng.random(len(token_ids)) < keep_prob]
+
+    def _negatives(self, shape, rng):
+        samples = np.searchsorted(self.noise_cumulative, rng.random(shape))
+        return np.minimum(samples, self.vocab_size - 1)
+
+    def _update(self, inputs, targets, rng, lr):
+        """
+        Eén mini-batch: inputs (B, k) token-ID's waarvan het gemiddelde de invoer is,
+        targets (B,) het echte token. Geeft de gemiddelde loss terug.
+        """
+        outputs = np.concatenate([targets[:, None], self._negatives((len(targets), self.negative), rng)],
+                                 axis=1)
+        labels = np.zeros(outputs.shape, dtype=np.float32)
+        labels[:, 0] = 1.0
+
+        h = self.w_in[inputs].mean(axis=1)
+        u = self.w_out[outputs]
+        scores = _sigmoid(np.einsum("bd,bkd->bk", h, u))
+        g = (labels - scores) * lr
+
+        grad_h = np.einsum("bk,bkd->bd", g, u) / inputs.shape[1]
+        np.add.at(self.w_out, outputs.ravel(), (g[:, :, None] * h[:, None, :]).reshape(-1, self.dim))
+        np.add.at(self.w_in, inputs.ravel(), np.repeat(grad_h, inputs.shape[1], axis=0))
+
+        picked = np.where(labels == 1.0, scores, 1.0 - scores)
+        return -np.log(np.maximum(picked, 1e-7)).sum(axis=1).mean()
+
+    def train_epoch(self, token_ids, rng=None, progress=(0.0, 1.0)):
+        """
+        Train één keer over token_ids.
+
+        :param progress: (start, eind) fractie van de hele training, voor het
+            lineair laten dalen van de learning rate.
+        :return aantal verwerkte tokens, gemiddelde loss
+        """
+        rng = rng if rng is not None else self.rng
+        token_ids = self._subsample(np.asarray(token_ids), rng)
+        w = self.window
+        if len(token_ids) <= 2 * w:
+            return 0, 0.0
+        windows = np.lib.stride_tricks.sliding_window_view(token_ids, 2 * w + 1)
+        order = rng.permutation(len(windows))
+
+        losses = []
+        for start in range(0, len(order), self.batch_size):
+            batch = windows[order[start:start + self.batch_size]]
+            done = progress[0] + (progress[1] - progress[0]) * start / len(order)
+            lr = self.learning_rate * max(1e-4, 1.0 - done)
+            center = batch[:, w]
+            context = np.delete(batch, w, axis=1)
+            if self.mode == "cbow":
+                losses.append(self._update(context, center, rng, lr))
+            else:
+                # Elk (token, context) paar is een eigen voorbeeld:
+                losses.append(self._update(np.repeat(center, 2 * w)[:, None], context.ravel(), rng, lr))
+        return len(token_ids), float(np.mean(losses))
+
+    def fit(self, token_ids, epochs=1, verbose=False, workers=1):
+        """
+        Train op een array met token-ID's. Zet self.tokens_per_second.
+
+        :param workers: aantal processen; bij meer dan 1 wordt Hogwild gebruikt
+            (zie _fit_hogwild), anders wordt in dit proces getraind.
+        """
+        token_ids = np.asarray(token_ids, dtype=np.int64)
+        self._prepare(token_ids)
+        if workers > 1:
+            return self._fit_hogwild(token_ids, epochs, workers, verbose)
+
+        n_tokens = 0
+        start = time.perf_counter()
+        for epoch in range(epochs):
+            done, loss = self.train_epoch(token_ids, progress=(epoch / epochs, (epoch + 1) / epochs))
+            n_tokens += done
+            if verbose:
+                print(f"epoch {epoch + 1}/{epochs}: loss {loss:.4f}")
+        self.tokens_per_second = n_tokens / (time.perf_counter() - start)
+        return self
+
+    def _fit_hogwild(self, token_ids, epochs, workers, verbose=False):
+        """
+        Hogwild: de tokens worden in aaneengesloten stukken over de processen verdeeld,
+        die allemaal zonder locks dezelfde w_in en w_out in shared memory bijwerken.
+        Omdat elke mini-batch maar een paar rijen raakt, botsen updates zelden.
+        """
+        shared = [shared_memory.SharedMemory(create=True, size=a.nbytes)
+                  for a in (self.w_in, self.w_out)]
+        try:
+            for shm, array in zip(shared, (self.w_in, self.w_out)):
+                np.ndarray(array.shape, array.dtype, buffer=shm.buf)[:] = array
+
+            # De worker krijgt alles behalve de matrices, die pakt hij uit shared memory:
+            config = copy.copy(self)
+            config.w_in = config.w_out = None
+            seeds = self.rng.bit_generator.seed_seq.spawn(workers)
+            jobs = [(config, [shm.name for shm in shared], shard, epochs, seed)
+                    for shard, seed in zip(np.array_split(token_ids, workers), seeds)]
+
+            start = time.perf_counter()
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(_hogwild_worker, jobs))
+            seconds = time.perf_counter() - start
+
+            for shm, name in zip(shared, ("w_in", "w_out")):
+                array = getattr(self, name)
+                array[:] = np.ndarray(array.shape, array.dtype, buffer=shm.buf)
+        finally:
+            for shm in shared:
+                shm.close()
+                shm.unlink()
+
+        if verbose:
+            for i, (_, loss) in enumerate(results):
+                print(f"worker {i + 1}/{workers}: loss laatste epoch {loss:.4f}")
+        self.tokens_per_second = sum(done for done, _ in results) / seconds
+        return self
+
+    def embeddings(self):
+        """
+        De embeddings als dict id -> vector, alleen voor tokens die voorkwamen
+        (zelfde formaat als extract_embeddings_from_mlp_ids()).
+        """
+        return {int(tid): self.w_in[tid] for tid in np.flatnonzero(self.counts)}
+
+
+def _hogwild_worker(job):
+    """
+    Train een shard in een eigen proces op de gedeelde matrices van EmbeddingTrainer.
+    """
+    trainer, names, token_ids, epochs, seed = job
+    shared = [shared_memory.SharedMemory(name=name) for name in names]
+    try:
+        shape = (trainer.vocab_size, trainer.dim)
+        trainer.w_in = np.ndarray(shape, np.float32, buffer=shared[0].buf)
+        trainer.w_out = np.ndarray(shape, np.float32, buffer=shared[1].buf)
+        rng = np.random.default_rng(seed)
+        n_tokens, loss = 0, 0.0
+        for epoch in range(epochs):
+            done, loss = trainer.train_epoch(token_ids, rng, (epoch / epochs, (epoch + 1) / epochs))
+            n_tokens += done
+        # De views moeten weg voordat het shared memory gesloten kan worden:
+        trainer.w_in = trainer.w_out = None
+        return n_tokens, loss
+    finally:
+        for shm in shared:
+            shm.close()
+
+
 def save_embeddings_with_bpe(path, id_to_vec, bpe_tokenizer):
     """
     Schrijf embeddings weg als TSV:
@@ -15,7 +15,9 @@ Encodings (*.enc) worden opgeslagen als JSON met o.a.:
 
 Tokens (*.tok) zijn spatiegescheiden integers.
 """
+import functools
 import json
+import re
 from collections import Counter
 
 import numpy as np
@@ -31,7 +33,7 @@ class BPETokenizer:
     - Slaat modelconfiguratie, vocab en merges op in JSON
     """
     def __init__(self, max_tokens=1000, min_freq=2,
-                 lowercase=False, merge_whitespace=False):
+                 lowercase=False, merge_whitespace=False, cache_size=100000):
         self.max_tokens = max_tokens
         self.min_freq = min_freq
         self.lowercase = lowercase
@@ -41,6 +43,9 @@ class BPETokenizer:
         self.token_to_id = {}
         self.merges = []
 
+        # LRU-cache: woord -> tokens, zodat hetzelfde woord maar een keer gemerged wordt.
+        self._encode_word = functools.lru_cache(maxsize=cache_size)(self._merge_all)
+
     def _normalize(self, text):
         return text.lower() if self.lowercase else text
 
@@ -71,6 +76,18 @@ class BPETokenizer:
                 i += 1
         return output
 
+    def _merge_all(self, text):
+        tokens = list(text)
+        for a, b, new_token in self.merges:
+            tokens = self._apply_merge(tokens, (a, b), new_token)
+        return tuple(tokens)
+
+    def cache_info(self):
+        """
+        Hits, misses, maxsize en currsize van de woord-cache van encode().
+        """
+        return self._encode_word.cache_info()
+
     def fit(self, text):
         """
         Train de BPE-tokenizer op ruwe invoertekst.
@@ -92,6 +109,7 @@ class BPETokenizer:
         tokens = list(text)
         vocab = set(tokens)
         self.merges = []
+        self._encode_word.cache_clear()
 
         while True:
             if len(vocab) >= self.max_tokens:
@@ -125,6 +143,8 @@ class BPETokenizer:
         - past alle geleerde BPE-merges toe in volgorde,
         - zet elk resulterend token om naar zijn numerieke ID.
 
+        Het resultaat per woord wordt bewaard in een LRU-cache, zie cache_info().
+
         Als een token niet direct voorkomt in de vocab (bijv. na merges),
         wordt het opgesplitst in individuele karakters die wél bekend zijn.
 
@@ -138,10 +158,18 @@ class BPETokenizer:
             raise ValueError("Tokenizer niet getraind of geladen.")
 
         text = self._normalize(text)
-        tokens = list(text)
 
-        for a, b, new_token in self.merges:
-            tokens = self._apply_merge(tokens, (a, b), new_token)
+        if self.merge_whitespace:
+            # Merges kunnen over woordgrenzen heen gaan, dus geen cache per woord:
+            tokens = self._merge_all(text)
+        else:
+            # Spaties worden nooit gemerged, dus elk woord kan los (en gecachet) worden:
+            tokens = []
+            for word in re.split(r"(\s)", text):
+                if word.isspace():
+                    tokens.append(word)
+                elif word:
+                    tokens.extend(self._encode_word(word))
 
         ids = []
         for tok in tokens:
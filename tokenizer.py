@@ -9,84 +9,152 @@ import sys
 import numpy
 from collections import Counter
 import pickle
-from nlp import (file_reader, get_vocabulary, tokenizer,
-                 sort_and_return_token, byte_pair_encoding,
-                 save_encoding, load_encoding)
+from nlp import (file_reader, get_vocabulary, save_encoding, load_encoding, BPETrainer,
+                 read_word_counts, WordEncoder, iter_word_batches,
+                 flatten_token_lists, encoding_id_to_token, tokens_to_ids,
+                 save_token_ids, TokWriter, is_token_id_file, load_token_ids,
+                 decode_token_ids, id_to_bytes_table)
 
 
 def input_parser():
     if len(sys.argv) <= 1 or sys.argv[1] in ("-h", "--help"):
         print("""Gebruik:
-        python tokenizer.py learn  txt <min_freq> [enc_path]
-        python tokenizer.py encode txt <enc_path>
+        python tokenizer.py learn  txt <min_freq> [enc_path] [--workers N]
+        python tokenizer.py encode txt <enc_path> [cache_size] [--stream] [--ids]
         python tokenizer.py decode tok <enc_path>
+        python tokenizer.py convert <oude_pickle.enc> <enc_path>
 
         Voorbeeld:
         python tokenizer.py learn  data/story.txt 3
         python tokenizer.py encode data/story.txt encoding.enc
+        python tokenizer.py encode data/groot.txt encoding.enc --stream --ids
         python tokenizer.py decode data/story.tok encoding.enc
+
+        --workers: tel de paren met N processen
+        --stream:  lees en schrijf per batch regels (voor bestanden groter dan het geheugen)
+        --ids:     schrijf de .tok als binaire token-ID's (zie nlp.load_token_ids)
             """)
 
+    flags = {}
+    if "--workers" in sys.argv:
+        i = sys.argv.index("--workers")
+        flags["--workers"] = int(sys.argv[i + 1])
+        del sys.argv[i:i + 2]
+    for flag in ("--stream", "--ids"):
+        if flag in sys.argv:
+            sys.argv.remove(flag)
+            flags[flag] = True
+
     action = sys.argv[1].lower()
     if action == "learn":
         txt_path = sys.argv[2]
         min_freq = int(sys.argv[3])
         enc_path = sys.argv[4] if len(sys.argv) > 4 else "encoding.enc"
-        return action, txt_path, enc_path, min_freq
+        return action, txt_path, enc_path, min_freq, flags
     elif action == "encode":
         txt_path = sys.argv[2]
         enc_path = sys.argv[3]
-        return action, txt_path, enc_path, None
+        cache_size = int(sys.argv[4]) if len(sys.argv) > 4 else 100000
+        return action, txt_path, enc_path, cache_size, flags
     elif action == "decode":
         tok_path = sys.argv[2]
         enc_path = sys.argv[3]
-        return action, tok_path, enc_path, None
+        return action, tok_path, enc_path, None, flags
+    elif action == "convert":
+        old_path = sys.argv[2]
+        enc_path = sys.argv[3]
+        return action, old_path, enc_path, None, flags
     else:
         raise ValueError("Onbekend commando... Type: --help ")
     
     
-def learn_encoding(txt_path, min_freq, enc_path):
-    word_list = file_reader(txt_path)
+def learn_encoding(txt_path, min_freq, enc_path, workers=1):
+    words, freqs, word_ids = read_word_counts(txt_path)
 
-    for _ in range(9999):
-        token_counts = tokenizer(word_list)
-        pair = sort_and_return_token(token_counts, min_freq)
-        if pair is None:
-            break
-        word_list = byte_pair_encoding(word_list, pair)
+    trainer = BPETrainer(words, freqs, workers)
+    trainer.train(min_freq)
+    word_list = trainer.expand(word_ids)
 
     vocab_counts, vocab_set = get_vocabulary(word_list)
-    save_encoding(vocab_set, word_list, enc_path)
+    save_encoding(vocab_set, word_list, enc_path, trainer.merges)
 
     print(f"Encoding opgeslagen in '{enc_path}'.")
     print(f"{len(vocab_set)} unieke tokens gevonden.")
 
-def apply_encoding(txt_path, enc_path):
-    enc_db = load_encoding(enc_path)
-    vocab = enc_db["vocabulary"]
-    word_list = file_reader(txt_path)
+def warn_unknown(unknown):
+    """
+    Meld karakters die geen token-ID hebben en dus niet in de binaire .tok staan.
+    """
+    if not unknown:
+        return
+    examples = ", ".join(f"{ch!r} ({n}x)" for ch, n in unknown.most_common(10))
+    print(f"Waarschuwing: {sum(unknown.values())} karakters zitten niet in de encoding en zijn "
+          f"weggelaten uit de .tok: {examples}. Encodeer zonder --ids om ze te bewaren, "
+          f"of leer de encoding opnieuw op tekst met deze karakters.", file=sys.stderr)
 
 
-    while True:
-        token_counts = tokenizer(word_list)
-        pair = sort_and_return_token(token_counts, min_freq=1)
-        if pair is None:
-            break
-        word_list = byte_pair_encoding(word_list, pair)
-        
+def apply_encoding(txt_path, enc_path, cache_size=100000, ids=False):
+    enc_db = load_encoding(enc_path)
+    if not enc_db.get("merges"):
+        raise ValueError(f"'{enc_path}' bevat geen merges, leer de encoding opnieuw met 'learn'.")
+    encoder = WordEncoder(enc_db["merges"], cache_size)
+    word_list = encoder.encode_words(file_reader(txt_path))
 
     tok_path = txt_path.rsplit(".", 1)[0] + ".tok"
-    with open(tok_path, "w") as f:
-        for w in word_list:
-            f.write("".join(w))
+    if ids:
+        id_to_token = encoding_id_to_token(enc_db)
+        token_to_id = {tok: i for i, tok in enumerate(id_to_token)}
+        unknown = Counter()
+        save_token_ids(tok_path, tokens_to_ids(flatten_token_lists(word_list), token_to_id, unknown),
+                       id_to_token)
+        warn_unknown(unknown)
+    else:
+        with open(tok_path, "w") as f:
+            for w in word_list:
+                f.write("".join(w))
     print(f"Tokens opgeslagen in '{tok_path}'.")
+    info = encoder.cache_info()
+    print(f"Cache: {info.hits} hits, {info.misses} misses.")
     return word_list
 
 
+def stream_encoding(txt_path, enc_path, cache_size=100000, ids=False, batch_lines=10000):
+    """
+    Zelfde als apply_encoding(), maar leest en schrijft per batch regels,
+    zodat het geheugengebruik niet afhangt van de grootte van het bestand.
+    """
+    enc_db = load_encoding(enc_path)
+    if not enc_db.get("merges"):
+        raise ValueError(f"'{enc_path}' bevat geen merges, leer de encoding opnieuw met 'learn'.")
+    encoder = WordEncoder(enc_db["merges"], cache_size)
+    id_to_token = encoding_id_to_token(enc_db)
+    token_to_id = {tok: i for i, tok in enumerate(id_to_token)}
+    del enc_db
+
+    tok_path = txt_path.rsplit(".", 1)[0] + ".tok"
+    if ids:
+        unknown = Counter()
+        with TokWriter(tok_path, id_to_token) as writer:
+            for batch in iter_word_batches(txt_path, batch_lines):
+                tokens = [t for w in batch for t in encoder.encode(w)]
+                writer.write(tokens_to_ids(tokens, token_to_id, unknown))
+        warn_unknown(unknown)
+    else:
+        with open(tok_path, "w") as f:
+            for batch in iter_word_batches(txt_path, batch_lines):
+                f.write("".join("".join(encoder.encode(w)) for w in batch))
+    print(f"Tokens opgeslagen in '{tok_path}'.")
+    info = encoder.cache_info()
+    print(f"Cache: {info.hits} hits, {info.misses} misses.")
+
+
 def decode_tokens(tok_path, enc_path):
     enc_db = load_encoding(enc_path)
     vocab = enc_db["vocabulary"]
 
+    if is_token_id_file(tok_path):
+        return decode_token_id_file(tok_path, enc_db)
+
     with open(tok_path, "r") as file:
         flat = list(file.read())
 
@@ -114,13 +182,42 @@ def decode_tokens(tok_path, enc_path):
         file.write(txt)
     print(f"Tekst teruggeconverteerd naar '{txt_path}'.")
     return vocab
+
+
+def decode_token_id_file(tok_path, enc_db):
+    """
+    Decodeer een binaire .tok: elk ID wordt direct opgezocht in de id -> token tabel.
+    """
+    id_to_token = encoding_id_to_token(enc_db)
+    token_ids = load_token_ids(tok_path, id_to_token)
+    id_to_bytes = id_to_bytes_table(id_to_token)
+
+    txt_path = tok_path.rsplit(".", 1)[0] + ".txt"
+    with open(txt_path, "wb") as file:
+        for chunk in decode_token_ids(token_ids, id_to_bytes):
+            file.write(chunk)
+    print(f"Tekst teruggeconverteerd naar '{txt_path}'.")
+    return enc_db["vocabulary"]
+
+
+def convert_encoding(old_path, enc_path):
+    """
+    Zet een oude pickle .enc om naar de .enc container.
+    """
+    enc_db = load_encoding(old_path)
+    save_encoding(enc_db["vocabulary"], enc_db.get("text_tokens"), enc_path, enc_db.get("merges"))
+    print(f"Encoding omgezet naar '{enc_path}'.")
     
     
 if __name__ == "__main__":
-    action, path, enc_path, min_freq = input_parser()
+    action, path, enc_path, option, flags = input_parser()
     if action == "learn":
-        learn_encoding(path, min_freq, enc_path)
+        learn_encoding(path, option, enc_path, flags.get("--workers", 1))
+    elif action == "encode" and "--stream" in flags:
+        stream_encoding(path, enc_path, option, ids="--ids" in flags)
     elif action == "encode":
-        apply_encoding(path, enc_path)
+        apply_encoding(path, enc_path, option, ids="--ids" in flags)
     elif action == "decode":
-        decode_tokens(path, enc_path)
\ No newline at end of file
+        decode_tokens(path, enc_path)
+    elif action == "convert":
+        convert_encoding(path, enc_path)
\ No newline at end of file